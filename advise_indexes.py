@@ -0,0 +1,40 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Propose secondary indexes from the columns recent player queries join on and filter by
+
+import argparse
+from datetime import datetime, timedelta
+
+from utils.index_advisor import (advise, apply_shared_indexes, declared_indexes, shared_indexes,
+                                 write_template_indexes)
+from utils.query_log import read_query_log
+from utils.utils import GAME_TABLE_DDL
+
+parser = argparse.ArgumentParser(description="Propose secondary indexes for the game tables from the query log.")
+parser.add_argument("--path", help="query log file written by the file sink, defaults to QUERY_LOG_PATH")
+parser.add_argument("--tidb", action="store_true", help="read the query_log table instead of the file")
+parser.add_argument("--days", type=float, default=7, help="only look at player queries of the last days")
+parser.add_argument("--min-queries", type=int, default=5, help="queries that must use a column to index it")
+parser.add_argument("--shared", action="store_true", help="advise for the shared tables instead of the template")
+parser.add_argument("--apply", action="store_true",
+                    help="create the indexes in the shared tables, or store them for new game schemas")
+args = parser.parse_args()
+
+entries = read_query_log(path=args.path, tidb=args.tidb, kind="player",
+                         since=datetime.now() - timedelta(days=args.days))
+indexed = shared_indexes() if args.shared else declared_indexes(GAME_TABLE_DDL)
+proposals = advise([entry["query"] for entry in entries], min_queries=args.min_queries, indexed=indexed)
+
+print(f"{len(entries)} player queries in the last {args.days:g} days, {len(proposals)} proposed indexes")
+print(f"{'table':<12}{'column':<24}{'queries':>9}{'joins':>7}{'filters':>9}")
+for proposal in proposals:
+    print(f"{proposal.table:<12}{proposal.column:<24}{proposal.queries:>9}{proposal.joins:>7}{proposal.filters:>9}")
+    print(f"  {proposal.create_query(shared=args.shared)}")
+
+if args.apply and proposals:
+    if args.shared:
+        for query in apply_shared_indexes(proposals):
+            print(f"Created: {query}")
+    else:
+        write_template_indexes(proposals)
+        print("Stored, new game schemas are created with these indexes")
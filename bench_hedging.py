@@ -0,0 +1,52 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Compare LLM latency with and without hedging against the fake LLM latency model
+
+import argparse
+import statistics
+import time
+
+from utils.fake_llm import FakeQueryEngine, LatencyModel
+from utils.hedging import HedgeBudget, Hedger
+
+parser = argparse.ArgumentParser(description="Benchmark hedged LLM requests with a fake LLM.")
+parser.add_argument("--requests", type=int, default=200)
+parser.add_argument("--threshold", type=float, default=0.08, help="hedge after this many seconds without a token")
+parser.add_argument("--budget", type=float, default=0.1, help="hedges allowed per request")
+parser.add_argument("--seed", type=int, default=42)
+args = parser.parse_args()
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def run(hedger: Hedger | None) -> list:
+    # time scaled down 10x: 50 ms median to first token, 5% of requests 10x slower
+    engine = FakeQueryEngine(LatencyModel(first_token_median=0.05, tail_probability=0.05,
+                                          token_interval=0.001, seed=args.seed))
+    latencies = []
+
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        if hedger is None:
+            str(engine.query("prompt"))
+        else:
+            hedger.text(lambda: engine.query("prompt").response_gen)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+baseline = run(None)
+hedger = Hedger(threshold=args.threshold, budget=HedgeBudget(ratio=args.budget, burst=2))
+hedged = run(hedger)
+time.sleep(1)  # let cancelled requests report their first token
+
+for name, latencies in (("baseline", baseline), ("hedged", hedged)):
+    print(f"{name:>8}: p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+          f"mean {statistics.mean(latencies) * 1000:7.1f} ms")
+
+print("metrics:", hedger.metrics.snapshot())
@@ -0,0 +1,82 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Compare typical player queries on a large case before and after the advised secondary indexes
+
+import argparse
+import time
+from datetime import datetime
+
+from utils.dry_run import create_dry_run_db
+from utils.index_advisor import advise, foreign_key_indexes
+from utils.procedural import FILLER_COLUMNS, FillerGenerator, chunked
+from utils.utils import GAME_TABLE_DDL
+
+parser = argparse.ArgumentParser(description="Benchmark player queries on an in-memory SQLite large case.")
+parser.add_argument("--suspects", type=int, default=50_000)
+parser.add_argument("--repeat", type=int, default=20)
+args = parser.parse_args()
+
+# what players typically ask a case: alibis around the time of death, evidence against a suspect...
+WORKLOAD = [
+    "SELECT s.name, a.alibi, a.alibi_time FROM Suspects s JOIN Alibis a ON s.suspect_id = a.suspect_id "
+    "WHERE a.alibi_time BETWEEN '2024-10-01 21:30:00' AND '2024-10-01 21:35:00';",
+    "SELECT * FROM Evidence WHERE points_to_suspect_id = 4242;",
+    "SELECT e.description, s.name FROM Evidence e JOIN Suspects s ON e.points_to_suspect_id = s.suspect_id "
+    "WHERE s.suspect_id = 777;",
+    "SELECT a.* FROM Alibis a WHERE a.suspect_id = 1234 AND a.alibi_verified = 0;",
+    "SELECT s.name, COUNT(*) FROM Suspects s JOIN Evidence e ON e.points_to_suspect_id = s.suspect_id "
+    "WHERE s.name = '佐藤 翔太' GROUP BY s.name;",
+    "SELECT * FROM CrimeScene WHERE location = '書斎';",
+]
+
+
+def load_case(suspects: int):
+    conn = create_dry_run_db()
+    # TiDB and MySQL index foreign keys on their own, SQLite has to be told
+    for query in foreign_key_indexes(GAME_TABLE_DDL):
+        conn.execute(query)
+    conn.execute("INSERT INTO Victim VALUES (1, '山田 太郎', 60, '実業家', '2024-10-01 22:00:00', '書斎');")
+    conn.execute("INSERT INTO CrimeScene VALUES (1, '書斎', '荒らされた書斎', 1, 1);")
+
+    generator = FillerGenerator(seed=2024, suspects=suspects, first_suspect_id=1, first_alibi_id=1,
+                                first_evidence_id=1, scene_ids=[1], time_of_death=datetime(2024, 10, 1, 22, 0),
+                                reserved_names=set())
+    for table, rows in (("Suspects", generator.suspect_rows()),
+                        ("Alibis", generator.alibi_rows()),
+                        ("Evidence", generator.evidence_rows())):
+        columns = FILLER_COLUMNS[table]
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+        for chunk in chunked(rows, 5000):
+            conn.executemany(query, [tuple(str(value) if isinstance(value, datetime) else value for value in row)
+                                     for row in chunk])
+    conn.commit()
+    return conn
+
+
+def run_workload(conn) -> list:
+    timings = []
+    for query in WORKLOAD:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            conn.execute(query).fetchall()
+        timings.append((time.perf_counter() - start) / args.repeat * 1000)
+    return timings
+
+
+conn = load_case(args.suspects)
+conn.execute("ANALYZE;")
+before = run_workload(conn)
+
+proposals = advise(WORKLOAD, min_queries=1)
+for proposal in proposals:
+    conn.execute(proposal.create_query())
+conn.execute("ANALYZE;")
+after = run_workload(conn)
+
+print(f"{args.suspects} filler suspects, {len(proposals)} advised indexes:")
+for proposal in proposals:
+    print(f"  {proposal.create_query()}")
+print(f"{'query':>5}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+for i, (b, a) in enumerate(zip(before, after)):
+    print(f"{i + 1:>5}{b:>12.3f}{a:>12.3f}{b / a:>9.1f}x")
+print(f"{'all':>5}{sum(before):>12.3f}{sum(after):>12.3f}{sum(before) / sum(after):>9.1f}x")
@@ -0,0 +1,100 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Compare fixed-delay retries with backoff, circuit breaking and deadlines during an LLM brownout
+
+import argparse
+import statistics
+import threading
+import time
+
+from utils.fake_llm import FakeQueryEngine, FaultInjector, LatencyModel
+from utils.llm_client import LLMClient
+from utils.resilience import Backoff, CircuitBreaker, deadline
+
+parser = argparse.ArgumentParser(description="Simulate sessions calling a fake LLM through a brownout.")
+parser.add_argument("--sessions", type=int, default=8)
+parser.add_argument("--duration", type=float, default=6.0, help="seconds each session keeps calling")
+parser.add_argument("--brownout", type=float, nargs=2, default=[1.0, 4.0], help="start and end of the brownout")
+parser.add_argument("--deadline", type=float, default=1.0, help="deadline of one resilient call in seconds")
+parser.add_argument("--think", type=float, default=0.05, help="seconds a session waits between calls")
+parser.add_argument("--seed", type=int, default=42)
+args = parser.parse_args()
+
+
+def make_engine() -> FakeQueryEngine:
+    # time scaled down 10x: 50 ms to first token, failing calls hang 300 ms before the error
+    faults = FaultInjector(error_rate=0.01, brownouts=[tuple(args.brownout)], error=ConnectionError,
+                           error_delay=0.3, seed=args.seed)
+    return FakeQueryEngine(LatencyModel(first_token_median=0.05, tail_probability=0.0, token_interval=0.001,
+                                        seed=args.seed), faults=faults)
+
+
+def fixed_retry(client: LLMClient):
+    # the previous behavior: three attempts with a fixed sleep in between
+    for attempt in range(3):
+        try:
+            return client.text("prompt", cache=False)
+        except ConnectionError:
+            if attempt == 2:
+                raise
+            time.sleep(0.5)
+
+
+def run(name: str, call) -> dict:
+    engine = make_engine()
+    client_kwargs = {}
+    if name == "resilient":
+        # backoff scaled down like the latencies
+        client_kwargs = {"breaker": CircuitBreaker("llm", failure_threshold=5, reset_timeout=0.5), "retries": 2,
+                         "backoff": Backoff(base=0.02, cap=0.5, seed=args.seed)}
+    client = LLMClient(engine_factory=engine.factory, model="fake", params={}, **client_kwargs)
+
+    results = []
+    lock = threading.Lock()
+
+    def session():
+        stop = time.monotonic() + args.duration
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                call(client)
+                ok = True
+            except Exception:
+                ok = False
+            with lock:
+                results.append((ok, time.perf_counter() - start))
+            time.sleep(args.think)
+
+    threads = [threading.Thread(target=session) for _ in range(args.sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    failed = [elapsed for ok, elapsed in results if not ok]
+    report = {
+        "calls": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "mean_fail_ms": statistics.mean(failed) * 1000 if failed else 0.0,
+        "max_fail_ms": max(failed) * 1000 if failed else 0.0,
+        "llm_requests": engine.calls,
+        "injected_faults": engine.faults.injected,
+    }
+    if client.breaker is not None:
+        report["breaker"] = client.breaker.snapshot()
+    return report
+
+
+def resilient(client: LLMClient):
+    with deadline(args.deadline):
+        return client.text("prompt", cache=False)
+
+
+for name, call in (("fixed", fixed_retry), ("resilient", resilient)):
+    report = run(name, call)
+    breaker = report.pop("breaker", None)
+    print(f"{name:<10}" + "  ".join(f"{key} {value:.0f}" if isinstance(value, float) else f"{key} {value}"
+                                    for key, value in report.items()))
+    if breaker:
+        print(f"{'':<10}breaker {breaker}")
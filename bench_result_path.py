@@ -0,0 +1,104 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Compare the dict-per-row DataFrame result path with the chunked Arrow result path
+
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+from pymysql.constants import FIELD_TYPE
+
+from utils.utils import fetch_arrow_table
+
+parser = argparse.ArgumentParser(description="Benchmark result set conversion for st.dataframe.")
+parser.add_argument("--rows", type=int, default=200_000)
+parser.add_argument("--chunk-size", type=int, default=1000)
+args = parser.parse_args()
+
+# an Evidence-like result: ints, strings, a datetime and a boolean
+DESCRIPTION = [
+    ("evidence_id", FIELD_TYPE.LONG),
+    ("description", FIELD_TYPE.BLOB),
+    ("found_at_location", FIELD_TYPE.VAR_STRING),
+    ("points_to_suspect_id", FIELD_TYPE.LONG),
+    ("found_at", FIELD_TYPE.DATETIME),
+    ("verified", FIELD_TYPE.TINY),
+]
+
+
+class TupleCursor:
+    """
+    Stand-in for a pymysql tuple cursor over rows already read from the wire.
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.position = 0
+        self.description = [(name, type_code, None, None, None, None, True) for name, type_code in DESCRIPTION]
+
+    def fetchmany(self, size: int) -> list:
+        chunk = self.rows[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+class DictCursor(TupleCursor):
+    """
+    Stand-in for pymysql's DictCursor, which turns every row into a dict.
+    """
+
+    def fetchall(self) -> list:
+        names = [desc[0] for desc in self.description]
+        return [dict(zip(names, row)) for row in self.rows]
+
+
+def make_rows(count: int) -> list:
+    start = datetime(2024, 10, 1, 20, 0)
+    return [(i, f"Torn letter found near the piano, item {i}", f"Room {i % 40}", i % 500,
+             start + timedelta(minutes=i % 720), i % 2) for i in range(count)]
+
+
+def dict_path(rows: list):
+    cursor = DictCursor(rows)
+    data = cursor.fetchall()
+    column_names = [desc[0] for desc in cursor.description]
+    return pd.DataFrame(data, columns=column_names)
+
+
+def arrow_path(rows: list):
+    return fetch_arrow_table(TupleCursor(rows), chunk_size=args.chunk_size)
+
+
+def measure(path, rows: list) -> tuple:
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    result = path(rows)
+
+    elapsed = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_bytes = pa.total_allocated_bytes() - arrow_before
+
+    del result
+    return elapsed, python_peak, arrow_bytes
+
+
+rows = make_rows(args.rows)
+print(f"{args.rows} rows x {len(DESCRIPTION)} columns")
+
+results = {}
+for name, path in (("dict rows -> pandas", dict_path), ("tuple chunks -> arrow", arrow_path)):
+    elapsed, python_peak, arrow_bytes = measure(path, rows)
+    results[name] = (elapsed, python_peak + arrow_bytes)
+    print(f"{name:>22}: {elapsed * 1000:8.1f} ms  python peak {python_peak / 2 ** 20:7.1f} MiB  "
+          f"arrow {arrow_bytes / 2 ** 20:6.1f} MiB")
+
+(old_time, old_memory), (new_time, new_memory) = results.values()
+print(f"time saved {(1 - new_time / old_time) * 100:.0f}%, peak memory saved {(1 - new_memory / old_memory) * 100:.0f}%")
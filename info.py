@@ -1,5 +1,9 @@
 import streamlit as st
 
+from utils.hedging import get_hedger
+from utils.resilience import get_breakers
+from utils.scheduler import get_scheduler
+
 
 st.markdown("""
 # QueryHunt - SQL Murder Mystery Game
@@ -29,3 +33,22 @@ If you want to learn more, contribute, or just say hi, you can connect with me o
 - [![Twitter](https://img.shields.io/badge/X-1DA1F2?style=for-the-badge&logo=x&logoColor=white)](https://x.com/alexarsentiev)
 
 """)
+
+
+# runtime metrics of this app process, for operators
+with st.expander("Service status"):
+    st.subheader("Query scheduler")
+    st.caption("Running and queued queries, and queue waits per priority class")
+    st.json(get_scheduler().stats())
+
+    st.subheader("LLM hedging")
+    hedger = get_hedger()
+    if hedger is None:
+        st.caption("Hedging is disabled, set LLM_HEDGE_THRESHOLD to enable it")
+    else:
+        st.caption("Hedged LLM requests and the latency they saved")
+        st.json(hedger.metrics.snapshot())
+
+    st.subheader("Circuit breakers")
+    st.caption("State and call counters of every dependency behind a circuit breaker")
+    st.json(get_breakers().snapshot())
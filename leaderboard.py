@@ -1,6 +1,8 @@
+import pyarrow as pa
 import streamlit as st
-from utils.utils import get_connection
-import pandas as pd
+from pymysql.cursors import SSCursor
+from utils.scheduler import Priority
+from utils.utils import fetch_arrow_table, scheduled_connection
 
 st.title("Leaderboard 🏆")
 
@@ -8,28 +10,24 @@ query = "SELECT username, date, time_sec FROM leaderboard ORDER BY time_sec ASC
 
 @st.cache_data
 def get_leaderboard(query):
-    with get_connection(autocommit=True, database="original_game_schema") as conn:
-        with conn.cursor() as cursor:
+    with scheduled_connection(Priority.INTERACTIVE, database="original_game_schema") as conn:
+        with conn.cursor(SSCursor) as cursor:
             cursor.execute(query)
-            data = cursor.fetchall()
 
-            column_names = [desc[0] for desc in cursor.description]
-            df = pd.DataFrame(data, columns=column_names)
+            return fetch_arrow_table(cursor)
 
-            return df
 
-
-df = get_leaderboard(query)
+table = get_leaderboard(query)
 
 # change column names for better readability, capitalize, remove underscores
-df.columns = df.columns.str.replace('_', ' ').str.capitalize()
+column_names = [name.replace('_', ' ').capitalize() for name in table.column_names]
 
 # change time_sec to Time (in seconds)
-df.rename(columns={'Time sec': 'Time (in seconds)'}, inplace=True)
+column_names = ['Time (in seconds)' if name == 'Time sec' else name for name in column_names]
+table = table.rename_columns(column_names)
 
 # add rank column
-df.insert(0, 'Rank', range(1, 1 + len(df)))
+table = table.add_column(0, 'Rank', pa.array(range(1, 1 + table.num_rows)))
 
 # display the result as df
-st.dataframe(df, hide_index=True, width=600)
-
+st.dataframe(table, hide_index=True, width=600)
@@ -0,0 +1,31 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Restore a game snapshot into a schema, no LLM calls involved
+
+import argparse
+import time
+
+from pymysql.err import ProgrammingError
+
+import utils.utils as utils
+from utils.snapshot import read_snapshot, restore_snapshot
+
+parser = argparse.ArgumentParser(description="Restore a QueryHunt game snapshot into a schema.")
+parser.add_argument("snapshot", help="path to a .json.gz snapshot file")
+parser.add_argument("schema", help="schema to restore the game into")
+args = parser.parse_args()
+
+snapshot = read_snapshot(args.snapshot)
+
+try:
+    utils.create_schema_and_tables(schema_name=args.schema)
+except ProgrammingError:
+    # schema already exists, the restore resets its tables
+    pass
+
+start = time.perf_counter()
+restore_snapshot(schema_name=args.schema, snapshot=snapshot)
+elapsed_ms = (time.perf_counter() - start) * 1000
+
+rows = sum(len(table["rows"]) for table in snapshot["tables"])
+print(f"Restored game {snapshot['id'][:12]} ({rows} rows) into {args.schema} in {elapsed_ms:.1f} ms")
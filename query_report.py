@@ -0,0 +1,49 @@
+#!/bin/env python
+# -*- coding: utf-8 -*-
+# Report the most expensive query fingerprints from the query log
+
+import argparse
+from collections import defaultdict
+
+from utils.query_log import read_query_log
+
+parser = argparse.ArgumentParser(description="Aggregate the query log by fingerprint, ordered by total time.")
+parser.add_argument("--path", help="query log file written by the file sink, defaults to QUERY_LOG_PATH")
+parser.add_argument("--tidb", action="store_true", help="read the query_log table instead of the file")
+parser.add_argument("--kind", help="only report one kind of query, e.g. player or generation")
+parser.add_argument("--top", type=int, default=10)
+args = parser.parse_args()
+
+entries = read_query_log(path=args.path, tidb=args.tidb, kind=args.kind)
+
+groups = defaultdict(list)
+fingerprints = {}
+for entry in entries:
+    groups[entry["fingerprint_id"]].append(entry)
+    fingerprints[entry["fingerprint_id"]] = entry["fingerprint"]
+
+report = []
+for fingerprint_id, group in groups.items():
+    latencies = sorted(entry["latency_ms"] for entry in group)
+    report.append({
+        "fingerprint_id": fingerprint_id,
+        "calls": len(group),
+        "total_ms": sum(latencies),
+        "mean_ms": sum(latencies) / len(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "max_ms": latencies[-1],
+        "rows": sum(entry["rows"] or 0 for entry in group),
+        "bytes": sum(entry["bytes"] or 0 for entry in group),
+    })
+
+report.sort(key=lambda item: item["total_ms"], reverse=True)
+total_ms = sum(item["total_ms"] for item in report) or 1
+
+print(f"{len(entries)} queries, {len(report)} fingerprints, {total_ms / 1000:.1f} s total")
+print(f"{'fingerprint':<17}{'calls':>7}{'total ms':>11}{'%':>6}{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}"
+      f"{'rows':>9}{'bytes':>11}")
+for item in report[:args.top]:
+    print(f"{item['fingerprint_id']:<17}{item['calls']:>7}{item['total_ms']:>11.1f}"
+          f"{item['total_ms'] / total_ms * 100:>6.1f}{item['mean_ms']:>10.1f}{item['p95_ms']:>10.1f}"
+          f"{item['max_ms']:>10.1f}{item['rows']:>9}{item['bytes']:>11}")
+    print(f"  {fingerprints[item['fingerprint_id']][:200]}")
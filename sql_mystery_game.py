@@ -1,18 +1,33 @@
 import asyncio
+import itertools
+import random
 import re
 import time
 from datetime import datetime
 
-import pandas as pd
+import pyarrow as pa
 import pymysql
 import streamlit as st
 import streamlit.components.v1 as components
+from pymysql.cursors import SSCursor
 from pymysql.err import ProgrammingError
+from sqlglot import errors
 from streamlit_ace import st_ace
 
-from utils.utils import (create_schema_and_tables, generate_username,
-                         get_connection, get_vs_store, is_valid_query,
-                         run_queries_in_schema)
+from utils.library import (choose_library_game, ensure_library_game,
+                           get_game, is_shared_schema)
+from utils.llm_client import build_prompt, get_llm_client
+from utils.procedural import add_filler_data
+from utils.query_log import Timer, get_query_log
+from utils.resilience import CircuitOpenError, DeadlineExceeded, deadline
+from utils.scheduler import Priority
+from utils.session_store import (clear_session_state, restore_session_state,
+                                 save_session_state)
+from utils.tenancy import (ensure_shared_tables, game_location, is_shared_mode,
+                           scope_queries, scope_query)
+from utils.utils import (create_schema_and_tables, fetch_arrow_table,
+                         generate_username, is_valid_query,
+                         run_queries_in_schema, scheduled_connection)
 from utils.workflow import run_workflow
 
 
@@ -23,20 +38,27 @@ def show_hint(hint_prompt):
     if hint_button and st.session_state.ai_story is not None:
         with st.spinner("Thinking..."):
 
-            query_engine = get_vs_store()
-            response = query_engine.query(hint_prompt.format(story=st.session_state.ai_story,
-                                                             queries=st.session_state.user_queries,
-                                                             hints=st.session_state.ai_hints))
+            response = get_llm_client().stream(build_prompt(hint_prompt,
+                                                            story=st.session_state.ai_story,
+                                                            user_queries=st.session_state.user_queries,
+                                                            previous_hints=st.session_state.ai_hints))
+            try:
+                with deadline(float(st.secrets.get("HINT_DEADLINE_SECONDS", 30))):
+                    first_chunk = next(response, '')
+            except (CircuitOpenError, DeadlineExceeded):
+                st.warning("The detective's assistant is not available right now, please try again later.")
+                return
 
         hint_chunks = []
 
         # stream the response to the frontend
-        for chunk in st.write_stream(response.response_gen):
+        for chunk in st.write_stream(itertools.chain([first_chunk], response)):
             hint_chunks.append(chunk)
 
         # add to session state
         full_hint = ''.join(hint_chunks)
         st.session_state['ai_hints'].append(full_hint)
+        save_session_state()
 
 
 @st.fragment
@@ -50,23 +72,35 @@ def check_solution():
         st.session_state.user_solutions.append(user_solution)
 
         # get correct solution
-        with get_connection(autocommit=True, database=st.session_state.current_user) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT name from Murderer;")
-                data = cursor.fetchall()
-                solution = data[0]['name']
+        solution_query = "SELECT name from Murderer;"
+        if st.session_state.game_id is not None:
+            solution_query = scope_query(solution_query, st.session_state.game_id)
+
+        try:
+            with deadline(float(st.secrets.get("QUERY_DEADLINE_SECONDS", 30))):
+                with scheduled_connection(Priority.INTERACTIVE, st.session_state.current_user,
+                                          database=st.session_state.game_schema) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(solution_query)
+                        data = cursor.fetchall()
+                        solution = data[0]['name']
+        except (pymysql.Error, CircuitOpenError, DeadlineExceeded) as e:
+            st.error(e)
+            return
 
         # compare correct solution with user solution
         if user_solution.strip() == solution.strip():
             # record end time
             st.session_state.end_time = time.time()
             st.session_state.elapsed_time = st.session_state.end_time - st.session_state.start_time
+            save_session_state()
 
             st.balloons()
 
             # show dialog window
             end_game()
         else:
+            save_session_state()
             st.warning("Not exactly...try again!")
 
 
@@ -91,17 +125,28 @@ def sql_editor():
             st.error("Wrong query syntax or non-Select statement. Please provide a valid SQL query.")
         else:
             try:
-                with get_connection(autocommit=True, database=st.session_state.current_user) as conn:
-                    with conn.cursor() as cursor:
-                        cursor.execute(sql_query)
-                        data = cursor.fetchall()
-
-                        column_names = [desc[0] for desc in cursor.description]
-                        df = pd.DataFrame(data, columns=column_names)
-
-                        # display the result as df
-                        st.dataframe(df, hide_index=True)
-            except pymysql.Error as e:
+                # in shared storage mode the player's query only sees the rows of their game
+                if st.session_state.game_id is not None:
+                    sql_query = scope_query(sql_query, st.session_state.game_id)
+
+                with deadline(float(st.secrets.get("QUERY_DEADLINE_SECONDS", 30))):
+                    with scheduled_connection(Priority.INTERACTIVE, st.session_state.current_user,
+                                              database=st.session_state.game_schema) as conn:
+                        # unbuffered tuple cursor, rows go straight into Arrow columns chunk by chunk
+                        with conn.cursor(SSCursor) as cursor:
+                            with Timer() as timer:
+                                cursor.execute(sql_query)
+                                table = fetch_arrow_table(cursor)
+
+                            query_log = get_query_log()
+                            if query_log is not None:
+                                query_log.record("player", st.session_state.game_schema, sql_query, timer.ms,
+                                                 rows=table.num_rows, size=table.nbytes)
+
+                            # display the result as df
+                            st.dataframe(table, hide_index=True)
+            except (pymysql.Error, errors.ParseError, pa.ArrowException, ValueError, CircuitOpenError,
+                    DeadlineExceeded) as e:
                 st.error(e)
 
 
@@ -127,6 +172,9 @@ def end_game():
     # drop schema
     drop_temp_schema()
 
+    # the game is over, a reconnect must not bring it back
+    clear_session_state()
+
 
 def add_to_leaderboard():
     # Get today's date
@@ -140,20 +188,29 @@ def add_to_leaderboard():
     random_username = generate_username()
     values = (random_username, today_date, int(st.session_state.elapsed_time))
 
-    with get_connection(autocommit=True, database="original_game_schema") as conn:
+    with scheduled_connection(Priority.LEADERBOARD, st.session_state.current_user,
+                              database="original_game_schema") as conn:
         with conn.cursor() as cursor:
             cursor.execute(query, values)
 
 
 def drop_temp_schema():
+    # in shared storage mode only the rows of the player's own generated game are removed
+    if is_shared_mode():
+        schema_name, game_id = game_location(st.session_state.current_user)
+        run_queries_in_schema(schema_name=schema_name, query_list=scope_queries(delete_queries, game_id),
+                              priority=Priority.CLEANUP, session_id=st.session_state.current_user)
+        return
+
     # Get the current user's schema name
     schema_name = st.session_state.current_user
     
-    if schema_name:
+    # shared library schemas serve other players and are never dropped by a session
+    if schema_name and not is_shared_schema(schema_name):
         # Drop the temp schema by safely constructing the query
         query = f"DROP SCHEMA IF EXISTS `{schema_name}`;"
         
-        with get_connection(autocommit=True) as conn:
+        with scheduled_connection(Priority.CLEANUP, schema_name) as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query)
 
@@ -172,19 +229,7 @@ Use your knowledge of dbml game schema.
 Do not reveal the murderer.
 Keep the hint short.
 The hint should be in Japanese.
-
-In your hint, reference the game story:
----------------------
-{story}
----------------------
-Here are the user's SQL queries so far:
----------------------
-{queries}
----------------------
-Here are your previous hints:
----------------------
-{hints}
----------------------
+In your hint, reference the game story, the user's SQL queries so far and your previous hints below.
 """
 
 # for resetting temp db
@@ -214,6 +259,12 @@ if "elapsed_time" not in st.session_state:
     st.session_state.elapsed_time = None
 if "current_user" not in st.session_state:
     st.session_state.current_user = None
+if "game_schema" not in st.session_state:
+    st.session_state.game_schema = None
+if "game_id" not in st.session_state:
+    st.session_state.game_id = None
+if "played_games" not in st.session_state:
+    st.session_state.played_games = []
 
 
 st.title("SQL Murder Mystery Game")
@@ -221,34 +272,94 @@ st.title("SQL Murder Mystery Game")
 # get unique user token from headers and add to session state
 get_current_user()
 
+# rehydrate the game of a player reconnecting to this or another app replica
+if "session_restored" not in st.session_state:
+    restore_session_state(st.session_state.current_user)
+    st.session_state.session_restored = True
+
 col1, col2 = st.columns(2)
 
 with col1:
+    large_case = st.toggle("Large case (hard mode)",
+                           help="Hide the story among tens of thousands of generated suspects, alibis and evidence")
+
     if st.button("Generate Story"):
-        
-        # create temporary schema and tables for the current user
-        with st.spinner("Loading temporary environment..."):
-            try:
-                create_schema_and_tables(schema_name=st.session_state.current_user)
 
-            # handle situation when schema already exists for a user, reset tables
-            except ProgrammingError:
-                run_queries_in_schema(schema_name=st.session_state.current_user,
-                          query_list=delete_queries)
+        # serve an already validated game from the library when the policy allows it,
+        # large cases are always generated fresh
+        library_game = None if large_case else choose_library_game(st.session_state.played_games)
 
-        
-        # run the workflow
-        try:
-            result = asyncio.run(run_workflow())
-            
-            # add to session state
-            st.session_state.ai_story = result['story']
-            st.session_state.start_time = time.time()
-
-        except Exception as e:
-            st.error("Oops...something went wrong. Please try again!")
-            # for debugging
-            # st.error(e)
+        if library_game is not None:
+            try:
+                with st.spinner("Loading case from the library..."):
+                    game_schema, game_id = ensure_library_game(library_game,
+                                                               session_id=st.session_state.current_user)
+                    story = get_game(library_game)['story']
+
+                st.markdown(story)
+
+                # add to session state
+                st.session_state.ai_story = story
+                st.session_state.game_schema = game_schema
+                st.session_state.game_id = game_id
+                st.session_state.played_games.append(library_game)
+                st.session_state.start_time = time.time()
+                save_session_state()
+
+            except Exception as e:
+                st.error("Oops...something went wrong. Please try again!")
+                # for debugging
+                # st.error(e)
+
+        else:
+            game_schema, game_id = game_location(st.session_state.current_user)
+
+            with st.spinner("Loading temporary environment..."):
+                # shared storage mode only needs the player's previous rows removed
+                if is_shared_mode():
+                    ensure_shared_tables()
+                    run_queries_in_schema(schema_name=game_schema, session_id=st.session_state.current_user,
+                                          query_list=scope_queries(delete_queries, game_id))
+
+                # create temporary schema and tables for the current user
+                else:
+                    try:
+                        create_schema_and_tables(schema_name=st.session_state.current_user)
+
+                    # handle situation when schema already exists for a user, reset tables
+                    except ProgrammingError:
+                        run_queries_in_schema(schema_name=st.session_state.current_user,
+                                  query_list=delete_queries)
+
+            # run the workflow
+            try:
+                result = asyncio.run(run_workflow())
+
+                # a failed workflow returns a message, its partial case must not be padded with filler
+                if not isinstance(result, dict) or not result.get('story'):
+                    raise ValueError(f"Story generation failed: {result}")
+
+                if large_case:
+                    seed = random.getrandbits(32)
+                    with st.spinner("Hiding the case among thousands of records..."):
+                        counts = add_filler_data(game_schema, seed=seed,
+                                                 suspects=int(st.secrets.get("LARGE_CASE_SUSPECTS", 20000)),
+                                                 game_id=game_id, session_id=st.session_state.current_user)
+                    print(f"Large case {game_schema} (seed {seed}): {counts}")
+
+                # add to session state
+                st.session_state.ai_story = result['story']
+                st.session_state.game_schema = game_schema
+                st.session_state.game_id = game_id
+                if result.get('snapshot_id'):
+                    st.session_state.played_games.append(result['snapshot_id'])
+                st.session_state.start_time = time.time()
+                save_session_state()
+
+            except Exception as e:
+                st.error("Oops...something went wrong. Please try again!")
+                # for debugging
+                # st.error(e)
 
 
 with col2:
@@ -0,0 +1,10 @@
+import pytest
+import streamlit as st
+
+
+@pytest.fixture(autouse=True)
+def secrets(monkeypatch):
+    # tests configure what they need, nothing is read from .streamlit/secrets.toml
+    values = {}
+    monkeypatch.setattr(st, "secrets", values)
+    return values
@@ -0,0 +1,58 @@
+import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+from pymysql.constants import FIELD_TYPE
+
+from utils.utils import fetch_arrow_table
+
+
+class FakeCursor:
+    """
+    Tuple cursor returning a prepared result in chunks.
+    """
+
+    def __init__(self, description: list, rows: list):
+        self.description = description
+        self.rows = rows
+
+    def fetchmany(self, size: int) -> list:
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+
+def column(name: str, type_code: int, length: int = None, scale: int = 0) -> tuple:
+    return name, type_code, None, length, length, scale, True
+
+
+def test_decimal_precision_is_taken_from_the_column():
+    cursor = FakeCursor([column("d", FIELD_TYPE.NEWDECIMAL, length=14, scale=4)],
+                        [(Decimal("1.5"),), (Decimal("10.25"),), (None,)])
+
+    table = fetch_arrow_table(cursor, chunk_size=1)
+
+    assert table.schema.field("d").type == pa.decimal128(14, 4)
+    assert table.column("d").to_pylist() == [Decimal("1.5"), Decimal("10.25"), None]
+
+
+def test_wide_decimal():
+    cursor = FakeCursor([column("d", FIELD_TYPE.NEWDECIMAL, length=67, scale=30)], [(Decimal("1.5"),)])
+    assert fetch_arrow_table(cursor).schema.field("d").type == pa.decimal256(67, 30)
+
+
+def test_repeated_names_and_types_across_chunks():
+    cursor = FakeCursor([column("suspect_id", FIELD_TYPE.LONG, 11), column("suspect_id", FIELD_TYPE.LONG, 11),
+                         column("alibi_time", FIELD_TYPE.DATETIME, 19)],
+                        [(1, 1, datetime.datetime(2024, 1, 1, 22)), (2, None, None)])
+
+    table = fetch_arrow_table(cursor, chunk_size=1)
+
+    assert table.column_names == ["suspect_id", "suspect_id.1", "alibi_time"]
+    assert table.schema.field("suspect_id.1").type == pa.int64()
+    assert table.column("suspect_id.1").to_pylist() == [1, None]
+
+
+def test_empty_result_keeps_the_columns():
+    table = fetch_arrow_table(FakeCursor([column("d", FIELD_TYPE.NEWDECIMAL, 10, 2)], []))
+    assert table.num_rows == 0
+    assert table.schema.field("d").type == pa.decimal128(10, 2)
@@ -0,0 +1,35 @@
+import pytest
+
+from utils.dry_run import dry_run_queries
+
+VALID_INSERTS = [
+    "INSERT INTO Victim (victim_id, name, age, occupation, time_of_death, location_of_death) "
+    "VALUES (1, 'John Doe', 45, 'Banker', '2024-01-01 22:30:00', 'Library');",
+    "INSERT INTO Suspects (suspect_id, name, age, relationship_to_victim, motive) "
+    "VALUES (1, 'Mary Major', 30, 'Partner', 'Money'), (2, 'Jane Roe', 28, 'Sister', 'Jealousy');",
+    "INSERT INTO Alibis (alibi_id, suspect_id, alibi, alibi_verified, alibi_time) "
+    "VALUES (1, 2, 'At the cinema', TRUE, '2024-01-01 22:00:00');",
+    "INSERT INTO Murderer (murderer_id, suspect_id, name) VALUES (1, 1, 'Mary Major');",
+]
+
+
+def test_dry_run_accepts_valid_inserts():
+    dry_run_queries(VALID_INSERTS)
+
+
+@pytest.mark.parametrize("query, problem", [
+    ("INSERT INTO Alibis (alibi_id, suspect_id, alibi) VALUES (2, 99, 'Nowhere');", "FOREIGN KEY"),
+    ("INSERT INTO Suspects (suspect_id, name) VALUES (1, 'Twin');", "UNIQUE"),
+    ("INSERT INTO Suspects (suspect_id, name, age) VALUES (3, 'Old', 'eighty');", "is not an integer"),
+    ("INSERT INTO Suspects (suspect_id, name) VALUES (3, '" + "x" * 101 + "');", "longer than 100"),
+    ("INSERT INTO Murderer (murderer_id, suspect_id, name) VALUES (2, 2, 'Jane Roe');", "exactly one row"),
+])
+def test_dry_run_reports_problems(query, problem):
+    with pytest.raises(ValueError, match=problem):
+        dry_run_queries(VALID_INSERTS + [query])
+
+
+def test_dry_run_checks_the_murderer_is_a_suspect():
+    inserts = VALID_INSERTS[:-1] + ["INSERT INTO Murderer (murderer_id, suspect_id, name) VALUES (1, 2, 'Mary Major');"]
+    with pytest.raises(ValueError, match="does not match"):
+        dry_run_queries(inserts)
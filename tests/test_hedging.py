@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from utils.fake_llm import FakeQueryEngine, LatencyModel
+from utils.hedging import HedgeBudget, Hedger
+from utils.resilience import DeadlineExceeded, deadline
+
+
+class ScriptedLatency(LatencyModel):
+    """
+    Latency model giving the requests these times to first token, in order.
+    """
+
+    def __init__(self, *delays):
+        super().__init__(token_interval=0)
+        self.delays = list(delays)
+
+    def first_token_delay(self) -> float:
+        with self.lock:
+            return self.delays.pop(0)
+
+
+def wait_until(condition, timeout: float = 2):
+    stop = time.monotonic() + timeout
+    while not condition() and time.monotonic() < stop:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_fast_primary_is_not_hedged():
+    engine = FakeQueryEngine(ScriptedLatency(0.01))
+    hedger = Hedger(threshold=0.2, budget=HedgeBudget(ratio=1, burst=2))
+
+    assert hedger.text(lambda: engine.query("prompt").response_gen) == "This is a fake response to the prompt."
+    assert engine.calls == 1
+    assert hedger.metrics.snapshot()["hedges"] == 0
+
+
+@pytest.mark.parametrize("collect", [False, True])
+def test_hedge_wins_and_the_primary_is_cancelled(collect):
+    engine = FakeQueryEngine(ScriptedLatency(0.5, 0.01))
+    hedger = Hedger(threshold=0.05, budget=HedgeBudget(ratio=1, burst=2))
+    generators = []
+
+    def request():
+        generators.append(engine.query("prompt").response_gen)
+        return generators[-1]
+
+    start = time.monotonic()
+    if collect:
+        response = hedger.text(request)
+    else:
+        response = "".join(hedger.stream(request))
+
+    assert response == "This is a fake response to the prompt."
+    assert time.monotonic() - start < 0.3
+    assert hedger.metrics.snapshot()["hedges"] == 1
+    assert hedger.metrics.snapshot()["hedge_wins"] == 1
+
+    # the primary stops consuming its stream once its first token arrives
+    primary = generators[0]
+    assert wait_until(lambda: primary.gi_frame is None)
+    assert wait_until(lambda: hedger.metrics.snapshot()["latency_saved_s"] > 0.3)
+
+
+def test_no_hedge_without_budget():
+    engine = FakeQueryEngine(ScriptedLatency(0.2))
+    hedger = Hedger(threshold=0.05, budget=HedgeBudget(ratio=0, burst=0))
+
+    hedger.text(lambda: engine.query("prompt").response_gen)
+    assert engine.calls == 1
+    assert hedger.metrics.snapshot()["hedges"] == 0
+
+
+def test_budget_caps_hedges():
+    engine = FakeQueryEngine(ScriptedLatency(*[0.1, 0.1] * 4))
+    hedger = Hedger(threshold=0.02, budget=HedgeBudget(ratio=0, burst=2))
+
+    for _ in range(4):
+        hedger.text(lambda: engine.query("prompt").response_gen)
+    assert hedger.metrics.snapshot()["hedges"] == 2
+
+
+def test_deadline_stops_waiting():
+    engine = FakeQueryEngine(ScriptedLatency(0.6, 0.6))
+    hedger = Hedger(threshold=0.02, budget=HedgeBudget(ratio=1, burst=2))
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.1):
+            hedger.text(lambda: engine.query("prompt").response_gen)
+    assert time.monotonic() - start < 0.3
+
+
+def test_time_queued_for_a_worker_does_not_trigger_hedges():
+    engine = FakeQueryEngine(ScriptedLatency(*[0.05] * 8))
+    hedger = Hedger(threshold=0.08, budget=HedgeBudget(ratio=1, burst=10), max_workers=1)
+
+    threads = [threading.Thread(target=hedger.text, args=(lambda: engine.query("prompt").response_gen,))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert hedger.metrics.snapshot()["hedges"] == 0
@@ -0,0 +1,24 @@
+from utils.index_advisor import advise, declared_indexes
+from utils.tenancy import SHARED_TABLE_DDL
+from utils.utils import GAME_TABLE_DDL
+
+QUERIES = [
+    "SELECT * FROM Alibis WHERE suspect_id = 12;",
+    "SELECT * FROM Evidence e JOIN CrimeScene c ON e.scene_id = c.scene_id WHERE c.location = 'Library';",
+    "SELECT s.name FROM Suspects s JOIN Murderer m ON m.suspect_id = s.suspect_id WHERE s.name = 'Jane Roe';",
+]
+
+
+def test_foreign_keys_count_as_indexed():
+    indexed = declared_indexes(GAME_TABLE_DDL)
+
+    for key in [("Alibis", "suspect_id"), ("Evidence", "points_to_suspect_id"), ("Evidence", "scene_id"),
+                ("Murderer", "suspect_id"), ("Suspects", "suspect_id")]:
+        assert key in indexed
+    assert ("Suspects", "name") not in indexed
+    assert ("Alibis", "suspect_id") in declared_indexes(SHARED_TABLE_DDL)
+
+
+def test_advice_leaves_out_indexed_columns():
+    proposals = {(proposal.table, proposal.column) for proposal in advise(QUERIES, min_queries=1)}
+    assert proposals == {("CrimeScene", "location"), ("Suspects", "name")}
@@ -0,0 +1,140 @@
+import threading
+from contextlib import contextmanager
+
+import pytest
+from pymysql.constants import ER
+from pymysql.err import OperationalError, ProgrammingError
+
+from utils import library
+
+GAME_ID = "a" * 64
+
+
+class FakeServer:
+    """
+    Schemas and Murderer row counts of a TiDB server, with user-level locks.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+        self.locks = {}
+        self.calls = []
+
+    @contextmanager
+    def connect(self, *args, database: str = None, **kwargs):
+        if database is not None and database not in self.schemas:
+            raise OperationalError(ER.BAD_DB_ERROR, f"Unknown database '{database}'")
+        yield FakeConnection(self, database)
+
+
+class FakeConnection:
+    def __init__(self, server: FakeServer, database: str):
+        self.server = server
+        self.database = database
+        self.row = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query: str, args=None):
+        server = self.server
+        if query.startswith("SELECT GET_LOCK"):
+            lock = server.locks.setdefault(args[0], threading.Lock())
+            self.row = {"locked": int(lock.acquire(timeout=args[1]))}
+        elif query.startswith("SELECT RELEASE_LOCK"):
+            server.locks[args[0]].release()
+        elif query.startswith("DROP SCHEMA"):
+            server.calls.append("drop")
+            server.schemas.pop(query.split()[-1].rstrip(";"), None)
+        elif "COUNT(*)" in query:
+            tables = server.schemas[self.database]
+            if "Murderer" not in tables:
+                raise ProgrammingError(ER.NO_SUCH_TABLE, "Table 'Murderer' doesn't exist")
+            self.row = {"cnt": tables["Murderer"]}
+        else:
+            raise AssertionError(f"Unexpected query {query}")
+
+    def fetchone(self):
+        return self.row
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+
+    def create_schema_and_tables(schema_name: str, session_id: str = None):
+        if schema_name in server.schemas:
+            raise ProgrammingError(ER.DB_CREATE_EXISTS, "Can't create database; database exists")
+        server.calls.append("create")
+        server.schemas[schema_name] = {"Murderer": 0}
+
+    def restore_snapshot(schema_name: str, snapshot: dict, session_id: str = None):
+        server.calls.append("restore")
+        server.schemas[schema_name]["Murderer"] = 1
+
+    monkeypatch.setattr(library, "is_shared_mode", lambda: False)
+    monkeypatch.setattr(library, "get_game", lambda game_id: {})
+    monkeypatch.setattr(library, "get_connection", server.connect)
+    monkeypatch.setattr(library, "scheduled_connection", server.connect)
+    monkeypatch.setattr(library, "create_schema_and_tables", create_schema_and_tables)
+    monkeypatch.setattr(library, "restore_snapshot", restore_snapshot)
+    return server
+
+
+def test_missing_schema_is_not_loaded(server):
+    assert not library.is_loaded("game_abc")
+
+
+def test_half_created_schema_is_not_loaded(server):
+    server.schemas["game_abc"] = {"Victim": 0}
+    assert not library.is_loaded("game_abc")
+
+    server.schemas["game_abc"]["Murderer"] = 0
+    assert not library.is_loaded("game_abc")
+
+
+def test_first_use_creates_and_loads_the_game(server):
+    schema_name, game_id = library.ensure_library_game(GAME_ID)
+
+    assert (schema_name, game_id) == (library.shared_schema_name(GAME_ID), None)
+    assert server.calls == ["drop", "create", "restore"]
+    assert library.is_loaded(schema_name)
+
+
+def test_loaded_game_is_reused(server):
+    server.schemas[library.shared_schema_name(GAME_ID)] = {"Murderer": 1}
+
+    library.ensure_library_game(GAME_ID)
+    assert server.calls == []
+
+
+def test_half_created_game_is_recreated(server):
+    server.schemas[library.shared_schema_name(GAME_ID)] = {"Victim": 0}
+
+    library.ensure_library_game(GAME_ID)
+    assert server.calls == ["drop", "create", "restore"]
+
+
+def test_concurrent_first_use_loads_once(server):
+    errors = []
+
+    def play():
+        try:
+            library.ensure_library_game(GAME_ID)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=play) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert server.calls == ["drop", "create", "restore"]
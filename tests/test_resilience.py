@@ -0,0 +1,145 @@
+import time
+
+import pytest
+
+from utils.fake_llm import FakeQueryEngine, LatencyModel
+from utils.llm_client import LLMClient
+from utils.resilience import (Backoff, CircuitBreaker, CircuitOpenError,
+                              DeadlineExceeded, call_with_retry, deadline)
+
+NO_BACKOFF = Backoff(base=0, cap=0)
+
+
+class Flaky:
+    """
+    Dependency failing with the given errors before it answers.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def is_transient(e: Exception) -> bool:
+    return isinstance(e, (ConnectionError, TimeoutError)) and not isinstance(e, DeadlineExceeded)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("db", failure_threshold=2, reset_timeout=30)
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.snapshot()["rejections"] == 1
+
+
+def test_breaker_half_opens_for_a_single_probe():
+    breaker = CircuitBreaker("db", failure_threshold=1, reset_timeout=0.05)
+    breaker.allow()
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("db", failure_threshold=1, reset_timeout=0.05)
+    breaker.allow()
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.snapshot()["opened"] == 2
+
+
+def test_transient_errors_are_retried():
+    breaker = CircuitBreaker("db", failure_threshold=5)
+    fn = Flaky(ConnectionError("reset"), TimeoutError("slow"))
+
+    assert call_with_retry(fn, breaker, is_transient, retries=3, backoff=NO_BACKOFF) == "ok"
+    assert fn.calls == 3
+    assert breaker.snapshot()["failures"] == 2
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_answered_errors_are_raised_and_count_as_success():
+    breaker = CircuitBreaker("db", failure_threshold=1)
+    fn = Flaky(ValueError("unknown database"))
+
+    with pytest.raises(ValueError):
+        call_with_retry(fn, breaker, is_transient, retries=3, backoff=NO_BACKOFF)
+    assert fn.calls == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()["successes"] == 1
+
+
+def test_last_transient_error_is_raised_when_retries_run_out():
+    breaker = CircuitBreaker("db", failure_threshold=3)
+    fn = Flaky(*[ConnectionError("down")] * 5)
+
+    with pytest.raises(ConnectionError):
+        call_with_retry(fn, breaker, is_transient, retries=2, backoff=NO_BACKOFF)
+    assert fn.calls == 3
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # an open breaker fails fast without calling the dependency
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(fn, breaker, is_transient, retries=2, backoff=NO_BACKOFF)
+    assert fn.calls == 3
+
+
+def test_expired_deadline_is_not_a_failure_of_the_dependency():
+    breaker = CircuitBreaker("db", failure_threshold=1)
+
+    def timed_out():
+        time.sleep(0.06)
+        raise TimeoutError("read timed out")
+
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.05):
+            call_with_retry(timed_out, breaker, is_transient, retries=3, backoff=NO_BACKOFF)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.snapshot()["failures"] == 0
+
+    fn = Flaky()
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0):
+            call_with_retry(fn, breaker, is_transient, backoff=NO_BACKOFF)
+    assert fn.calls == 0
+
+
+def test_short_deadlines_do_not_open_the_llm_breaker():
+    engine = FakeQueryEngine(LatencyModel(first_token_median=0.3, sigma=0, tail_probability=0, token_interval=0))
+    breaker = CircuitBreaker("llm", failure_threshold=2, reset_timeout=30)
+    client = LLMClient(engine.factory, model="fake", params={}, breaker=breaker, retries=1, backoff=NO_BACKOFF)
+
+    for i in range(3):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            with deadline(0.05):
+                client.text(f"prompt {i}")
+        assert time.monotonic() - start < 0.2
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert client.text("prompt") == "This is a fake response to the prompt."
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+from utils.resilience import DeadlineExceeded, deadline
+from utils.scheduler import Priority, QueryScheduler
+
+
+def wait_for_waiters(scheduler: QueryScheduler, count: int):
+    stop = time.monotonic() + 2
+    while scheduler.stats()["waiting"] < count and time.monotonic() < stop:
+        time.sleep(0.01)
+    assert scheduler.stats()["waiting"] == count
+
+
+def test_slots_are_handed_out_by_priority_then_arrival():
+    scheduler = QueryScheduler(max_concurrency=1, session_rate=1000, session_burst=1000)
+    admitted = []
+
+    def query(priority: Priority, name: str):
+        with scheduler.slot(priority):
+            admitted.append(name)
+
+    arrivals = [(Priority.LOGGING, "log"), (Priority.GENERATION, "generate 1"),
+                (Priority.INTERACTIVE, "player"), (Priority.GENERATION, "generate 2")]
+    threads = []
+
+    with scheduler.slot(Priority.CLEANUP):
+        for i, (priority, name) in enumerate(arrivals):
+            thread = threading.Thread(target=query, args=(priority, name))
+            thread.start()
+            threads.append(thread)
+            wait_for_waiters(scheduler, i + 1)
+
+    for thread in threads:
+        thread.join()
+
+    assert admitted == ["player", "generate 1", "generate 2", "log"]
+    assert scheduler.stats()["INTERACTIVE"]["admitted"] == 1
+
+
+def test_query_not_admitted_before_its_deadline_is_rejected():
+    scheduler = QueryScheduler(max_concurrency=1, session_rate=1000, session_burst=1000)
+
+    with scheduler.slot(Priority.GENERATION):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            with deadline(0.05):
+                with scheduler.slot(Priority.INTERACTIVE):
+                    pass
+        assert time.monotonic() - start < 0.2
+        assert scheduler.stats()["waiting"] == 0
+
+    # the rejected query left no trace in the queue
+    with deadline(0.05):
+        with scheduler.slot(Priority.INTERACTIVE):
+            pass
+
+
+def test_rate_limit_past_the_deadline_is_rejected_at_once():
+    scheduler = QueryScheduler(max_concurrency=4, session_rate=1, session_burst=1)
+
+    with scheduler.slot(Priority.INTERACTIVE, "player"):
+        pass
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.1):
+            with scheduler.slot(Priority.INTERACTIVE, "player"):
+                pass
+    assert time.monotonic() - start < 0.05
+
+    # other sessions have their own bucket
+    with deadline(0.1):
+        with scheduler.slot(Priority.INTERACTIVE, "other player"):
+            pass
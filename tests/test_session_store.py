@@ -0,0 +1,100 @@
+import time
+
+from utils.session_store import (SessionStore, SQLiteSessionStore,
+                                 decode_state, encode_state, is_persisted)
+
+STATE = {"current_user": "player", "ai_story": "名探偵の事件", "user_queries": ["SELECT 1;"], "start_time": 1.5}
+
+
+class CountingBackend:
+    """
+    Backend recording how often it is written to.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.writes = 0
+
+    def read(self, session_key: str):
+        return self.backend.read(session_key)
+
+    def write(self, session_key: str, data: bytes):
+        self.writes += 1
+        self.backend.write(session_key, data)
+
+    def delete(self, session_key: str):
+        self.backend.delete(session_key)
+
+
+def test_encoding_round_trip():
+    assert decode_state(encode_state(STATE)) == STATE
+
+
+def test_state_survives_a_move_to_another_replica(tmp_path):
+    path = str(tmp_path / "session_state.db")
+    replica_a = SessionStore(SQLiteSessionStore(path, ttl=3600))
+    replica_b = SessionStore(SQLiteSessionStore(path, ttl=3600))
+
+    replica_a.save("player", STATE)
+    assert replica_b.load("player") == STATE
+
+    replica_b.save("player", {**STATE, "start_time": 2.5})
+    assert replica_a.load("player")["start_time"] == 2.5
+
+
+def test_unchanged_state_is_not_written_again(tmp_path):
+    backend = CountingBackend(SQLiteSessionStore(str(tmp_path / "session_state.db"), ttl=3600))
+    store = SessionStore(backend)
+
+    store.save("player", STATE)
+    store.save("player", dict(STATE))
+    assert backend.writes == 1
+
+    store.save("player", {**STATE, "ai_hints": ["look at the alibis"]})
+    assert backend.writes == 2
+
+
+def test_remembered_writes_are_bounded(tmp_path):
+    backend = CountingBackend(SQLiteSessionStore(str(tmp_path / "session_state.db"), ttl=3600))
+    store = SessionStore(backend, ttl=3600, max_sessions=2)
+
+    for player in ("a", "b", "c"):
+        store.save(player, STATE)
+    assert list(store.written) == ["b", "c"]
+
+    # a forgotten session is simply written again
+    store.save("a", STATE)
+    assert backend.writes == 4
+
+
+def test_unchanged_state_is_refreshed_before_it_expires(tmp_path):
+    backend = CountingBackend(SQLiteSessionStore(str(tmp_path / "session_state.db"), ttl=0.1))
+    store = SessionStore(backend, ttl=0.1)
+
+    store.save("player", STATE)
+    time.sleep(0.06)
+    store.save("player", STATE)
+    assert backend.writes == 2
+    assert store.load("player") == STATE
+
+
+def test_deleted_and_expired_state_is_not_restored(tmp_path):
+    path = str(tmp_path / "session_state.db")
+    store = SessionStore(SQLiteSessionStore(path, ttl=3600))
+
+    store.save("player", STATE)
+    store.delete("player")
+    assert store.load("player") is None
+
+    expired = SessionStore(SQLiteSessionStore(path, ttl=-1))
+    expired.save("player", STATE)
+    assert expired.load("player") is None
+    assert store.load("unknown") is None
+
+
+def test_shared_fallback_token_is_not_persisted(secrets):
+    secrets["USER_TOKEN"] = "sherlock2024"
+
+    assert is_persisted("player")
+    assert not is_persisted("sherlock2024")
+    assert not is_persisted(None)
@@ -0,0 +1,41 @@
+import datetime
+
+import pytest
+
+from utils.snapshot import (build_snapshot, dump_snapshot, load_snapshot,
+                            snapshot_id)
+
+TABLES = {
+    "Victim": (["victim_id", "name", "age", "occupation", "time_of_death", "location_of_death"],
+               [(1, "John Doe", 45, "Banker", datetime.datetime(2024, 1, 1, 22, 30), "Library")]),
+    "Suspects": (["suspect_id", "name", "age", "relationship_to_victim", "motive"],
+                 [(1, "佐藤 翔太", 30, "Partner", "Money"), (2, "Jane Roe", None, "Sister", "Jealousy")]),
+    "Murderer": (["murderer_id", "suspect_id", "name"], [(1, 1, "佐藤 翔太")]),
+}
+
+
+def test_snapshot_round_trip():
+    snapshot = build_snapshot("A story", TABLES)
+    data = dump_snapshot(snapshot)
+
+    assert load_snapshot(data) == snapshot
+    assert snapshot_id(load_snapshot(data)) == snapshot["id"]
+    assert snapshot["answer"] == "佐藤 翔太"
+
+    victim = next(table for table in snapshot["tables"] if table["name"] == "Victim")
+    assert victim["types"][4] == "datetime"
+    assert victim["rows"][0][4] == "2024-01-01T22:30:00"
+
+
+def test_snapshot_is_content_addressed():
+    assert dump_snapshot(build_snapshot("A story", TABLES)) == dump_snapshot(build_snapshot("A story", TABLES))
+    assert build_snapshot("Another story", TABLES)["id"] != build_snapshot("A story", TABLES)["id"]
+
+
+def test_foreign_data_is_not_a_snapshot():
+    snapshot = build_snapshot("A story", TABLES)
+
+    with pytest.raises(ValueError):
+        load_snapshot(dump_snapshot({**snapshot, "format": "other"}))
+    with pytest.raises(ValueError):
+        load_snapshot(dump_snapshot({**snapshot, "version": 99}))
@@ -0,0 +1,68 @@
+import pytest
+from sqlglot import exp, parse_one
+
+from utils.tenancy import scope_query
+from utils.utils import GAME_TABLES
+
+GAME_ID = "g1"
+
+
+def assert_scoped(sql_query: str):
+    # every game table has to be read through a select filtered by the game
+    tree = parse_one(sql_query, read="mysql")
+    tables = [table for table in tree.find_all(exp.Table) if table.name in GAME_TABLES]
+    assert tables
+
+    for table in tables:
+        select = table.find_ancestor(exp.Select)
+        assert select is not None
+        assert select.args.get("where") is not None
+        assert f"game_id = '{GAME_ID}'" in select.args["where"].sql(dialect="mysql")
+
+
+def test_select():
+    assert_scoped(scope_query("SELECT name FROM Murderer;", GAME_ID))
+
+
+def test_join_keeps_aliases():
+    scoped = scope_query("SELECT s.name, a.alibi FROM Suspects s JOIN Alibis a ON s.suspect_id = a.suspect_id;",
+                         GAME_ID)
+    assert_scoped(scoped)
+    assert "AS s" in scoped and "AS a" in scoped
+
+
+def test_subqueries():
+    assert_scoped(scope_query("SELECT name FROM Suspects WHERE suspect_id IN (SELECT suspect_id FROM Murderer);",
+                              GAME_ID))
+    assert_scoped(scope_query("SELECT t.name FROM (SELECT name FROM Murderer) t;", GAME_ID))
+
+
+def test_db_qualified_table():
+    scoped = scope_query("SELECT name FROM other_game.Murderer;", GAME_ID)
+    assert_scoped(scoped)
+    assert "other_game" not in scoped
+
+
+def test_cte_reading_game_table():
+    scoped = scope_query("WITH m AS (SELECT * FROM Murderer) SELECT name FROM m;", GAME_ID)
+    assert_scoped(scoped)
+
+
+@pytest.mark.parametrize("sql_query", [
+    "WITH Murderer AS (SELECT * FROM Murderer) SELECT * FROM Murderer;",
+    "WITH murderer AS (SELECT 1 AS x) SELECT * FROM Murderer;",
+    "SELECT * FROM (WITH Murderer AS (SELECT * FROM Murderer) SELECT * FROM Murderer) t;",
+])
+def test_cte_named_like_game_table(sql_query):
+    with pytest.raises(ValueError):
+        scope_query(sql_query, GAME_ID)
+
+
+def test_insert():
+    scoped = scope_query("INSERT INTO Murderer (murderer_id, suspect_id, name) VALUES (1, 2, 'x');", GAME_ID)
+    assert "(game_id, murderer_id, suspect_id, name)" in scoped
+    assert f"VALUES ('{GAME_ID}', 1, 2, 'x')" in scoped
+
+
+def test_delete():
+    assert f"WHERE game_id = '{GAME_ID}'" in scope_query("DELETE FROM Evidence;", GAME_ID)
@@ -0,0 +1,109 @@
+import sqlite3
+from functools import cache
+
+from sqlglot import exp, parse_one, transpile
+
+from utils.utils import GAME_TABLE_DDL
+
+
+@cache
+def get_column_types() -> dict[str, list[tuple[str, str, int | None]]]:
+    """
+    Function that returns the declared type of every game table column, read from the game DDL.
+    :return: mapping of table name to (column, type, length) tuples
+    """
+    columns = {}
+    for table, ddl in GAME_TABLE_DDL.items():
+        create = parse_one(ddl, read="mysql")
+        columns[table] = []
+        for column in create.this.expressions:
+            if not isinstance(column, exp.ColumnDef):
+                continue
+            data_type = column.args["kind"]
+            size = data_type.expressions[0].name if data_type.expressions else None
+            columns[table].append((column.name, data_type.this.name, int(size) if size else None))
+    return columns
+
+
+def create_dry_run_db() -> sqlite3.Connection:
+    """
+    Function that creates an in-memory SQLite copy of the game tables with foreign keys enforced.
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(":memory:")
+    conn.execute("PRAGMA foreign_keys = ON;")
+    for ddl in GAME_TABLE_DDL.values():
+        conn.execute(transpile(ddl, read="mysql", write="sqlite")[0])
+    return conn
+
+
+def _type_errors(conn: sqlite3.Connection) -> list[str]:
+    problems = []
+
+    for table, columns in get_column_types().items():
+        for column, type_name, size in columns:
+            if type_name in ("INT", "BOOLEAN"):
+                # INTEGER affinity already converted numeric text, what is left is not a number
+                condition = f"typeof({column}) NOT IN ('integer', 'null')"
+                problem = "is not an integer"
+            elif type_name == "DATETIME":
+                condition = f"{column} IS NOT NULL AND datetime({column}) IS NULL"
+                problem = "is not a valid datetime"
+            elif type_name == "VARCHAR" and size:
+                condition = f"length({column}) > {size}"
+                problem = f"is longer than {size} characters"
+            else:
+                continue
+
+            bad = conn.execute(f"SELECT {column} FROM {table} WHERE {condition} LIMIT 3;").fetchall()
+            if bad:
+                values = ", ".join(repr(row[0]) for row in bad)
+                problems.append(f"{table}.{column} {problem}: {values}")
+
+    return problems
+
+
+def _invariant_errors(conn: sqlite3.Connection) -> list[str]:
+    problems = []
+
+    if conn.execute("SELECT COUNT(*) FROM Victim;").fetchone()[0] == 0:
+        problems.append("Victim table is empty")
+
+    murderers = conn.execute("SELECT suspect_id, name FROM Murderer;").fetchall()
+    if len(murderers) != 1:
+        problems.append(f"Murderer table must contain exactly one row, found {len(murderers)}")
+        return problems
+
+    suspect_id, name = murderers[0]
+    suspect = conn.execute("SELECT name FROM Suspects WHERE suspect_id = ?;", (suspect_id,)).fetchone()
+    if suspect is None:
+        problems.append(f"Murderer suspect_id {suspect_id} does not exist in Suspects")
+    elif (suspect[0] or "").strip() != (name or "").strip():
+        problems.append(f"Murderer name {name!r} does not match the name of suspect {suspect_id} ({suspect[0]!r})")
+
+    return problems
+
+
+def dry_run_queries(query_list: list):
+    """
+    Apply generated insert queries to an in-memory SQLite copy of the game tables and check them
+    before they are sent to TiDB: foreign keys, duplicate primary keys, column types and lengths,
+    exactly one murderer who is one of the suspects.
+    :param query_list: insert queries written for TiDB
+    :raises ValueError: describing every problem found
+    """
+    problems = []
+
+    with create_dry_run_db() as conn:
+        for i, query in enumerate(query_list):
+            try:
+                for statement in transpile(query, read="mysql", write="sqlite"):
+                    conn.execute(statement)
+            except sqlite3.Error as e:
+                problems.append(f"Query {i + 1} failed: {e}: {query}")
+
+        problems += _type_errors(conn)
+        problems += _invariant_errors(conn)
+
+    if problems:
+        raise ValueError("Dry run of the insert queries failed:\n" + "\n".join(problems))
@@ -0,0 +1,146 @@
+import random
+import threading
+import time
+
+
+class LatencyModel:
+    """
+    Latency model of an LLM provider: a log-normal time to first token with an occasional
+    slow outlier, followed by a steady token rate.
+    """
+
+    def __init__(self, first_token_median: float = 0.8, sigma: float = 0.3, tail_probability: float = 0.05,
+                 tail_multiplier: float = 10.0, token_interval: float = 0.01, seed: int = None):
+        self.first_token_median = first_token_median
+        self.sigma = sigma
+        self.tail_probability = tail_probability
+        self.tail_multiplier = tail_multiplier
+        self.token_interval = token_interval
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def first_token_delay(self) -> float:
+        """
+        Draw the time to first token of one request.
+        :return: seconds
+        """
+        with self.lock:
+            delay = self.random.lognormvariate(0, self.sigma) * self.first_token_median
+            if self.random.random() < self.tail_probability:
+                delay *= self.tail_multiplier
+        return delay
+
+
+class FaultInjector:
+    """
+    Failure model of a dependency for offline tests: calls fail at error_rate, and always during
+    brownout windows given as (start, end) seconds since the injector was created.
+    """
+
+    def __init__(self, error_rate: float = 0.0, brownouts: list = None, error=ConnectionError,
+                 error_delay: float = 0.0, seed: int = None):
+        self.error_rate = error_rate
+        self.brownouts = brownouts or []
+        self.error = error
+        self.error_delay = error_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.injected = 0
+
+    def maybe_fail(self):
+        """
+        Raise the configured error when the call is to fail, after error_delay seconds.
+        """
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            fail = (any(start <= elapsed < end for start, end in self.brownouts)
+                    or self.random.random() < self.error_rate)
+            if fail:
+                self.injected += 1
+
+        if fail:
+            time.sleep(self.error_delay)
+            raise self.error("Injected fault")
+
+    def wrap(self, fn):
+        """
+        Wrap a callable, e.g. a connect function, so that it fails according to this model.
+        :param fn: callable
+        :return: wrapped callable
+        """
+        def wrapped(*args, **kwargs):
+            self.maybe_fail()
+            return fn(*args, **kwargs)
+        return wrapped
+
+
+class FakeStreamingResponse:
+    """
+    Stand-in for a llama-index streaming response: tokens come from response_gen and
+    str() waits for the whole text. Like the provider client, waiting longer than timeout
+    for the first token raises TimeoutError.
+    """
+
+    def __init__(self, text: str, latency: LatencyModel, timeout: float = None):
+        self.text = text
+        self.latency = latency
+        self.timeout = timeout
+        self.response_gen = self._generate()
+        self._response_txt = None
+
+    def _generate(self):
+        delay = self.latency.first_token_delay()
+        if self.timeout is not None and delay > self.timeout:
+            time.sleep(self.timeout)
+            raise TimeoutError("Request timed out")
+        time.sleep(delay)
+        for i, token in enumerate(self.text.split(" ")):
+            if i:
+                time.sleep(self.latency.token_interval)
+            yield token if i == 0 else f" {token}"
+
+    def __str__(self) -> str:
+        if self._response_txt is None:
+            self._response_txt = "".join(self.response_gen)
+        return self._response_txt
+
+
+class FakeQueryEngine:
+    """
+    Offline stand-in for the llama-index query engine returned by get_vs_store.
+    """
+
+    def __init__(self, latency: LatencyModel = None, responder=None, faults: FaultInjector = None):
+        self.latency = latency or LatencyModel()
+        self.responder = responder or (lambda prompt: "This is a fake response to the prompt.")
+        self.faults = faults
+        self.calls = 0
+
+    def query(self, prompt: str, timeout: float = None) -> FakeStreamingResponse:
+        self.calls += 1
+        if self.faults is not None:
+            self.faults.maybe_fail()
+        return FakeStreamingResponse(self.responder(prompt), self.latency, timeout)
+
+    def factory(self, timeout: float = None):
+        """
+        Engine factory for LLMClient: the engines share this one's models and calls,
+        their requests time out after timeout seconds.
+        :param timeout: seconds, None for no timeout
+        :return: query engine
+        """
+        return self if timeout is None else _TimedQueryEngine(self, timeout)
+
+
+class _TimedQueryEngine:
+    """
+    View of a FakeQueryEngine whose requests time out, like an engine created with an LLM request timeout.
+    """
+
+    def __init__(self, engine: FakeQueryEngine, timeout: float):
+        self.engine = engine
+        self.timeout = timeout
+
+    def query(self, prompt: str) -> FakeStreamingResponse:
+        return self.engine.query(prompt, timeout=self.timeout)
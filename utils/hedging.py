@@ -0,0 +1,270 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils.resilience import DeadlineExceeded, remaining
+
+
+class HedgeBudget:
+    """
+    Caps the extra spend of hedging: every primary request earns `ratio` of a hedge,
+    a hedge costs one, and at most `burst` hedges can be saved up.
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class HedgeMetrics:
+    """
+    Counters of hedged requests.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+
+    def record(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        """
+        Current metrics.
+        :return: requests, hedges, hedge rate, hedge wins and latency saved in seconds
+        """
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "latency_saved_s": self.latency_saved,
+            }
+
+
+class _Attempt:
+    """
+    One LLM request running in a worker thread, reporting to the shared queue of its hedged call.
+    """
+
+    def __init__(self, index: int, start: float, events: queue.Queue, collect: bool):
+        self.index = index
+        self.start = start
+        self.events = events
+        self.collect = collect
+        self.cancelled = threading.Event()
+        self.started_at = None
+        self.first_token_at = None
+        self.iterator = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def run(self, fn):
+        # the hedge threshold counts from here, time queued for a worker is not the provider's
+        self.started_at = time.monotonic()
+        self.events.put(("started", self, None))
+        try:
+            self.iterator = iter(fn())
+            first = next(self.iterator, "")
+            self.first_token_at = time.monotonic() - self.start
+            self.events.put(("first", self, first))
+
+            if not self.collect:
+                return
+
+            chunks = [first]
+            for chunk in self.iterator:
+                if self.cancelled.is_set():
+                    break
+                chunks.append(chunk)
+            else:
+                self.events.put(("done", self, "".join(chunks)))
+        except Exception as e:
+            self.events.put(("error", self, e))
+        finally:
+            if self.cancelled.is_set():
+                self.close()
+
+    def close(self):
+        # closing the generator stops consuming the provider stream
+        with self.lock:
+            if not self.closed and hasattr(self.iterator, "close"):
+                self.iterator.close()
+            self.closed = True
+
+    def cancel(self):
+        self.cancelled.set()
+
+        # a streaming attempt stops running after its first token, so it can be closed from here,
+        # one still waiting for its first token closes itself when it arrives
+        if not self.collect and self.first_token_at is not None:
+            self.close()
+
+
+class Hedger:
+    """
+    Hedged LLM requests: when the first request has not produced a token within `threshold`
+    seconds of running, a second identical request is started if the budget allows, the first valid result
+    wins and the other request is cancelled. Every request holds a worker until it is done or cancelled,
+    max_workers should allow two per session waiting for the LLM.
+    """
+
+    def __init__(self, threshold: float, budget: HedgeBudget, max_workers: int = 64):
+        self.threshold = threshold
+        self.budget = budget
+        self.metrics = HedgeMetrics()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def _launch(self, fn, attempts: list, start: float, events: queue.Queue, collect: bool) -> _Attempt:
+        attempt = _Attempt(len(attempts), start, events, collect)
+        attempts.append(attempt)
+        # attempts run with the caller's deadline
+        self.executor.submit(contextvars.copy_context().run, attempt.run, fn)
+        return attempt
+
+    def _finish(self, winner: _Attempt, attempts: list):
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel()
+
+        if winner.index > 0:
+            self.metrics.record(hedge_wins=1)
+            # the cancelled primary still reports its first token, which tells how much was saved
+            primary = attempts[0]
+            threading.Thread(target=self._record_saved, args=(primary, winner), daemon=True).start()
+
+    def _record_saved(self, primary: _Attempt, winner: _Attempt, timeout: float = 120):
+        deadline = time.monotonic() + timeout
+        while primary.first_token_at is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if primary.first_token_at is not None:
+            self.metrics.record(latency_saved=max(0.0, primary.first_token_at - winner.first_token_at))
+
+    def _wait(self, fn, collect: bool, validate=None):
+        self.budget.earn()
+        self.metrics.record(requests=1)
+
+        start = time.monotonic()
+        events = queue.Queue()
+        attempts = []
+        self._launch(fn, attempts, start, events, collect)
+
+        failures = 0
+        last_error = None
+        last_invalid = None
+
+        while True:
+            # only the primary can trigger a hedge, once it is running and before any token arrived
+            primary = attempts[0]
+            hedge_possible = len(attempts) == 1 and primary.first_token_at is None
+            timeout = None
+            if hedge_possible and primary.started_at is not None:
+                timeout = max(0.0, self.threshold - (time.monotonic() - primary.started_at))
+            left = remaining()
+            if left is not None:
+                timeout = max(0.0, left) if timeout is None else max(0.0, min(timeout, left))
+
+            try:
+                kind, attempt, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                left = remaining()
+                if left is not None and left <= 0:
+                    for attempt in attempts:
+                        if attempt is not None:
+                            attempt.cancel()
+                    raise DeadlineExceeded("Deadline exceeded waiting for the LLM")
+                if (not hedge_possible or primary.started_at is None
+                        or time.monotonic() - primary.started_at < self.threshold):
+                    continue
+                if self.budget.try_spend():
+                    self.metrics.record(hedges=1)
+                    self._launch(fn, attempts, start, events, collect)
+                else:
+                    # no budget left, stop waking up for the hedge decision
+                    attempts.append(None)
+                continue
+
+            if kind == "started":
+                continue
+
+            if kind == "error" or (kind == "done" and validate is not None and not validate(payload)):
+                failures += 1
+                if kind == "error":
+                    last_error = payload
+                else:
+                    last_invalid = (attempt, payload)
+
+                if failures >= len([a for a in attempts if a is not None]):
+                    # nothing valid came back, an invalid response is still handed to the caller
+                    if last_invalid is not None:
+                        return last_invalid
+                    raise last_error
+                continue
+
+            if kind == "first" and collect:
+                continue
+
+            attempts = [a for a in attempts if a is not None]
+            self._finish(attempt, attempts)
+            return attempt, payload
+
+    def stream(self, fn):
+        """
+        Hedged streaming request, the first request to produce a token wins.
+        :param fn: callable starting the request and returning an iterator of text chunks
+        :return: generator of text chunks of the winning request
+        """
+        attempt, first = self._wait(fn, collect=False)
+        yield first
+        yield from attempt.iterator
+
+    def text(self, fn, validate=None) -> str:
+        """
+        Hedged request for a whole response, the first valid response wins.
+        When no response is valid the last one is returned, errors are raised only when all requests failed.
+        :param fn: callable starting the request and returning an iterator of text chunks
+        :param validate: callable checking a full response, None accepts any response
+        :return: text of the winning response
+        """
+        _, text = self._wait(fn, collect=True, validate=validate)
+        return text
+
+
+@st.cache_resource
+def get_hedger() -> Hedger | None:
+    """
+    Function that returns the process-wide hedger for LLM requests,
+    or None when hedging is disabled (LLM_HEDGE_THRESHOLD is not set). LLM_HEDGE_BUDGET caps the hedges
+    per request, LLM_HEDGE_WORKERS the requests running at once.
+    :return: Hedger or None
+    """
+    threshold = st.secrets.get("LLM_HEDGE_THRESHOLD")
+    if not threshold:
+        return None
+
+    budget = HedgeBudget(ratio=float(st.secrets.get("LLM_HEDGE_BUDGET", 0.1)), burst=2)
+    return Hedger(threshold=float(threshold), budget=budget,
+                  max_workers=int(st.secrets.get("LLM_HEDGE_WORKERS", 64)))
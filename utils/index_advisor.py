@@ -0,0 +1,236 @@
+import json
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+import streamlit as st
+from sqlglot import exp, parse_one
+
+from utils.dry_run import get_column_types
+from utils.tenancy import SHARED_TABLE_DDL, get_shared_schema, get_table_columns
+from utils.utils import GAME_TABLE_DDL, GAME_TABLES, get_connection
+
+# predicates an index on the column operand can serve
+INDEXABLE_PREDICATES = (exp.EQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between, exp.In, exp.Like, exp.Is)
+
+
+@dataclass
+class IndexProposal:
+    """
+    Secondary index proposed for one game table column, with the number of queries that would use it.
+    """
+    table: str
+    column: str
+    queries: int
+    joins: int
+    filters: int
+
+    @property
+    def name(self) -> str:
+        return f"idx_{self.table.lower()}_{self.column}"
+
+    def create_query(self, shared: bool = False) -> str:
+        """
+        CREATE INDEX statement for the per-game template tables or, prefixed with game_id, the shared tables.
+        :param shared: index the shared tables
+        :return: query
+        """
+        columns = f"game_id, {self.column}" if shared else self.column
+        return f"CREATE INDEX IF NOT EXISTS {self.name} ON {self.table} ({columns});"
+
+
+def _game_table(name: str) -> str | None:
+    return next((table for table in GAME_TABLES if table.lower() == name.lower()), None)
+
+
+def _sources(tree: exp.Expression) -> dict[str, str]:
+    # alias or name -> game table, also through the game_id derived tables of scoped queries
+    sources = {}
+    for table in tree.find_all(exp.Table):
+        game_table = _game_table(table.name)
+        if game_table:
+            sources[table.alias_or_name.lower()] = game_table
+    for subquery in tree.find_all(exp.Subquery):
+        tables = list(subquery.this.find_all(exp.Table)) if subquery.this else []
+        if subquery.alias and len(tables) == 1 and _game_table(tables[0].name):
+            sources[subquery.alias.lower()] = _game_table(tables[0].name)
+    return sources
+
+
+def _resolve(column: exp.Column, sources: dict[str, str]) -> tuple[str, str] | None:
+    name = column.name.lower()
+    if name == "game_id":
+        return None
+
+    if column.table:
+        table = sources.get(column.table.lower())
+        if table and name in (c.lower() for c in get_table_columns()[table]):
+            return table, name
+        return None
+
+    # unqualified column, resolve when exactly one table in the query has it
+    candidates = {table for table in sources.values() if name in (c.lower() for c in get_table_columns()[table])}
+    return (candidates.pop(), name) if len(candidates) == 1 else None
+
+
+def column_usage(sql_query: str) -> dict[tuple[str, str], str]:
+    """
+    Function that finds the game table columns a query joins on or filters by.
+    :param sql_query: player query, plain or scoped to a game
+    :return: mapping of (table, column) to "join" or "filter"
+    """
+    try:
+        tree = parse_one(sql_query, read="mysql")
+    except Exception:
+        return {}
+    if tree is None:
+        return {}
+
+    sources = _sources(tree)
+    usage = {}
+
+    for predicate in tree.find_all(*INDEXABLE_PREDICATES):
+        operands = [predicate.this, predicate.args.get("expression")]
+        columns = [operand for operand in operands if isinstance(operand, exp.Column)]
+        resolved = [c for c in (_resolve(column, sources) for column in columns) if c]
+
+        # column = column is a join, whether written in ON or in WHERE
+        if isinstance(predicate, exp.EQ) and len(columns) == 2:
+            for key in resolved:
+                usage[key] = "join"
+        elif predicate.find_ancestor(exp.Where, exp.Join, exp.Having):
+            for key in resolved:
+                usage.setdefault(key, "filter")
+
+    return usage
+
+
+def declared_indexes(ddl: dict[str, str]) -> set[tuple[str, str]]:
+    """
+    Function that returns the columns leading an index declared in table DDL, ignoring a game_id prefix.
+    Foreign keys count as indexes, TiDB and MySQL create one for them when none exists.
+    :param ddl: mapping of table name to CREATE TABLE statement
+    :return: set of (table, column)
+    """
+    indexed = set()
+    for table, query in ddl.items():
+        for columns in re.findall(r"(?:PRIMARY KEY|FOREIGN KEY|KEY \w+)\s*\(([^)]*)\)", query):
+            columns = [column.strip().lower() for column in columns.split(",")]
+            if columns[0] == "game_id" and len(columns) > 1:
+                columns = columns[1:]
+            indexed.add((table, columns[0]))
+    return indexed
+
+
+def foreign_key_indexes(ddl: dict[str, str]) -> list[str]:
+    """
+    Function that returns CREATE INDEX statements for the foreign keys declared in table DDL,
+    for databases that do not index foreign keys themselves (SQLite).
+    :param ddl: mapping of table name to CREATE TABLE statement
+    :return: list of queries
+    """
+    queries = []
+    for table, query in ddl.items():
+        for columns in re.findall(r"FOREIGN KEY\s*\(([^)]*)\)", query):
+            columns = [column.strip() for column in columns.split(",")]
+            queries.append(f"CREATE INDEX IF NOT EXISTS fk_{table.lower()}_{'_'.join(columns)} "
+                           f"ON {table} ({', '.join(columns)});")
+    return queries
+
+
+def advise(queries: list, min_queries: int = 5, indexed: set = None) -> list[IndexProposal]:
+    """
+    Function that proposes single column secondary indexes for the columns recent player queries
+    join on or filter by, leaving out columns that are already indexed, TEXT and BOOLEAN columns.
+    :param queries: player queries
+    :param min_queries: minimum number of queries using a column
+    :param indexed: (table, column) pairs that already lead an index
+    :return: proposals, most used first
+    """
+    indexed = indexed if indexed is not None else declared_indexes(GAME_TABLE_DDL)
+    # TEXT cannot be indexed whole and a BOOLEAN index selects half the table
+    unindexable = {(table, column.lower()) for table, columns in get_column_types().items()
+                   for column, type_name, _ in columns if type_name in ("TEXT", "BOOLEAN")}
+
+    joins, filters = Counter(), Counter()
+    for sql_query in queries:
+        for key, kind in column_usage(sql_query).items():
+            (joins if kind == "join" else filters)[key] += 1
+
+    proposals = []
+    for key in joins.keys() | filters.keys():
+        count = joins[key] + filters[key]
+        if count < min_queries or key in indexed or key in unindexable:
+            continue
+        proposals.append(IndexProposal(table=key[0], column=key[1], queries=count,
+                                       joins=joins[key], filters=filters[key]))
+
+    return sorted(proposals, key=lambda proposal: proposal.queries, reverse=True)
+
+
+def get_advice_path() -> str:
+    return st.secrets.get("INDEX_ADVICE_PATH", "index_advice.json")
+
+
+def write_template_indexes(proposals: list[IndexProposal], path: str = None):
+    """
+    Function that stores accepted proposals, new game schemas are created with these indexes.
+    :param proposals: accepted proposals
+    :param path: advice file, defaults to INDEX_ADVICE_PATH
+    """
+    with open(path or get_advice_path(), "w", encoding="utf-8") as file:
+        json.dump([proposal.__dict__ for proposal in proposals], file, indent=2)
+
+
+def template_index_queries(path: str = None) -> list[str]:
+    """
+    Function that returns the CREATE INDEX statements of the accepted proposals for a new game schema.
+    :param path: advice file, defaults to INDEX_ADVICE_PATH
+    :return: list of queries, empty when no advice was accepted
+    """
+    path = path or get_advice_path()
+    if not os.path.exists(path):
+        return []
+
+    with open(path, "r", encoding="utf-8") as file:
+        return [IndexProposal(**proposal).create_query() for proposal in json.load(file)]
+
+
+def apply_shared_indexes(proposals: list[IndexProposal]) -> list[str]:
+    """
+    Function that creates the proposed (game_id, column) indexes in the shared tables, skipping
+    columns an existing index already covers.
+    :param proposals: proposals to apply
+    :return: queries executed
+    """
+    schema_name = get_shared_schema()
+    executed = []
+
+    with get_connection(database=schema_name) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT table_name, index_name, seq_in_index, column_name FROM information_schema.statistics "
+                           "WHERE table_schema = %s ORDER BY table_name, index_name, seq_in_index;", (schema_name,))
+            leading = {}
+            for row in cursor.fetchall():
+                key = (row['table_name'].lower(), row['index_name'])
+                if key not in leading or leading[key] == "game_id":
+                    leading[key] = row['column_name'].lower()
+            indexed = {(table, column) for (table, _), column in leading.items()}
+
+            for proposal in proposals:
+                if (proposal.table.lower(), proposal.column) in indexed:
+                    continue
+                query = proposal.create_query(shared=True)
+                cursor.execute(query)
+                executed.append(query)
+
+    return executed
+
+
+def shared_indexes() -> set[tuple[str, str]]:
+    """
+    Function that returns the columns indexed by the shared table DDL.
+    :return: set of (table, column)
+    """
+    return declared_indexes(SHARED_TABLE_DDL)
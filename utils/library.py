@@ -0,0 +1,175 @@
+import os
+import random
+from contextlib import contextmanager
+
+import streamlit as st
+from pymysql.constants import ER
+from pymysql.err import OperationalError, ProgrammingError
+
+from utils.resilience import remaining
+from utils.scheduler import Priority
+from utils.snapshot import (get_snapshot_dir, read_snapshot, restore_snapshot,
+                            snapshot_id)
+from utils.tenancy import ensure_shared_tables, is_shared_mode, scope_query
+from utils.utils import (create_schema_and_tables, get_connection,
+                         scheduled_connection)
+
+SHARED_SCHEMA_PREFIX = "game_"
+
+
+def shared_schema_name(game_id: str) -> str:
+    """
+    Function that returns the name of the shared read-only schema serving a library game.
+    :param game_id: content hash of the game snapshot
+    :return: schema name
+    """
+    return f"{SHARED_SCHEMA_PREFIX}{game_id[:16]}"
+
+
+def is_shared_schema(schema_name: str) -> bool:
+    """
+    Check if a schema is a shared library schema, which must never be dropped by a player session.
+    :param schema_name: schema name
+    :return: boolean
+    """
+    return bool(schema_name) and schema_name.startswith(SHARED_SCHEMA_PREFIX)
+
+
+@st.cache_data(ttl=60)
+def list_games() -> list[str]:
+    """
+    Function that lists the ids of all validated games in the library.
+    :return: list of game ids
+    """
+    directory = get_snapshot_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(name[:-len(".json.gz")] for name in os.listdir(directory) if name.endswith(".json.gz"))
+
+
+@st.cache_data
+def get_game(game_id: str) -> dict:
+    """
+    Function that loads a library game and verifies it against its content hash.
+    :param game_id: content hash of the game snapshot
+    :return: snapshot dict
+    """
+    snapshot = read_snapshot(os.path.join(get_snapshot_dir(), f"{game_id}.json.gz"))
+
+    if snapshot_id(snapshot) != game_id:
+        raise ValueError(f"Library game {game_id} does not match its content hash")
+
+    return snapshot
+
+
+def choose_library_game(played_games: list[str]) -> str | None:
+    """
+    Decide between serving a library game and generating a fresh one.
+    A library game is reused with probability LIBRARY_REUSE_RATIO, only when at least
+    LIBRARY_MIN_GAMES games the player has not played yet are available.
+    :param played_games: ids of games already played in this session
+    :return: game id to reuse, or None to generate a fresh game
+    """
+    reuse_ratio = float(st.secrets.get("LIBRARY_REUSE_RATIO", 0.0))
+    min_games = int(st.secrets.get("LIBRARY_MIN_GAMES", 1))
+
+    candidates = [game_id for game_id in list_games() if game_id not in played_games]
+
+    if len(candidates) < min_games or random.random() >= reuse_ratio:
+        return None
+
+    return random.choice(candidates)
+
+
+@contextmanager
+def loading_lock(game_id: str):
+    """
+    Hold the TiDB user-level lock of a library game, so only one session loads it while the others wait.
+    The lock lives on a connection of its own outside the query scheduler: the loading itself
+    takes scheduler slots, holding one here as well could starve it.
+    :param game_id: content hash of the game snapshot
+    :raises TimeoutError: when the game did not become free within LIBRARY_LOCK_SECONDS or the deadline
+    """
+    lock_name = shared_schema_name(game_id)
+    timeout = float(st.secrets.get("LIBRARY_LOCK_SECONDS", 120))
+    left = remaining()
+    if left is not None:
+        timeout = min(timeout, left)
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, %s) AS locked;", (lock_name, max(0, int(timeout))))
+            if cursor.fetchone()['locked'] != 1:
+                raise TimeoutError(f"Timed out waiting for library game {game_id} to be loaded")
+            try:
+                yield
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s);", (lock_name,))
+
+
+def is_loaded(schema_name: str, game_id: str = None, session_id: str = None) -> bool:
+    """
+    Check if a library game is completely loaded. The snapshot is restored in a single transaction,
+    so Murderer rows are only visible once every table is loaded; a schema left without a Murderer table
+    by a failed creation counts as not loaded.
+    :param schema_name: schema of the game
+    :param game_id: game to look for in the shared tables, None for a per-game schema
+    :param session_id: session charged for the check
+    :return: boolean
+    """
+    query = "SELECT COUNT(*) AS cnt FROM Murderer;"
+    if game_id is not None:
+        query = scope_query(query, game_id)
+
+    try:
+        with scheduled_connection(Priority.GENERATION, session_id, database=schema_name) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                return cursor.fetchone()['cnt'] > 0
+    except ProgrammingError:
+        # unknown table
+        return False
+    except OperationalError as e:
+        # unknown schema, the game was never created
+        if e.args and e.args[0] == ER.BAD_DB_ERROR:
+            return False
+        raise
+
+
+def ensure_library_game(game_id: str, session_id: str = None) -> tuple[str, str | None]:
+    """
+    Make sure a library game is materialized for sharing, loading it on first use.
+    In per-schema mode the game gets its own shared schema, in shared storage mode its rows
+    are loaded into the shared tables under the game id. Sessions asking for the same game at once
+    wait for the first one to load it, a partially created game is loaded again from scratch.
+    :param game_id: content hash of the game snapshot
+    :param session_id: session charged for loading the game
+    :return: schema name and game id to scope queries with, None in per-schema mode
+    """
+    if is_shared_mode():
+        schema_name = ensure_shared_tables()
+
+        if not is_loaded(schema_name, game_id, session_id):
+            with loading_lock(game_id):
+                # another session may have loaded it while this one waited
+                if not is_loaded(schema_name, game_id, session_id):
+                    restore_snapshot(schema_name=schema_name, snapshot=get_game(game_id), game_id=game_id,
+                                     session_id=session_id)
+
+        return schema_name, game_id
+
+    schema_name = shared_schema_name(game_id)
+
+    if not is_loaded(schema_name, session_id=session_id):
+        with loading_lock(game_id):
+            if not is_loaded(schema_name, session_id=session_id):
+                # nobody plays a game that is not loaded, a partial schema is recreated
+                with scheduled_connection(Priority.GENERATION, session_id) as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"DROP SCHEMA IF EXISTS {schema_name};")
+
+                create_schema_and_tables(schema_name=schema_name, session_id=session_id)
+                restore_snapshot(schema_name=schema_name, snapshot=get_game(game_id), session_id=session_id)
+
+    return schema_name, None
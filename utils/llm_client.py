@@ -0,0 +1,313 @@
+import hashlib
+import json
+import os
+import itertools
+import threading
+from collections import defaultdict
+
+import openai
+import streamlit as st
+
+from utils.hedging import get_hedger
+from utils.resilience import (DeadlineExceeded, call_with_retry,
+                              check_deadline, get_breakers, remaining)
+from utils.utils import (LLM_MODEL, LLM_TEMPERATURE, VS_TABLE_NAME,
+                         get_vs_store)
+
+PROMPT_SEPARATOR = "---------------------"
+
+# provider errors worth retrying: brownouts, rate limits and timeouts
+TRANSIENT_LLM_ERRORS = (ConnectionError, TimeoutError, openai.APIConnectionError, openai.APITimeoutError,
+                        openai.RateLimitError, openai.InternalServerError)
+
+
+def is_transient_llm_error(e: Exception) -> bool:
+    # the caller's own deadline is a TimeoutError too, but not a failure of the provider
+    return isinstance(e, TRANSIENT_LLM_ERRORS) and not isinstance(e, DeadlineExceeded)
+
+
+def build_prompt(instructions: str, **sections) -> str:
+    """
+    Assemble a prompt with the static instructions first and the per-call sections last,
+    so consecutive calls share the longest possible prefix for provider-side prompt caching.
+    The schema retrieved by the query engine is placed in front of all of it.
+    :param instructions: static instructions of the prompt
+    :param sections: per-call sections, the keyword is used as the section title
+    :return: prompt
+    """
+    parts = [instructions.strip()]
+    for title, value in sections.items():
+        parts.append(f"{title.replace('_', ' ').capitalize()}:\n{PROMPT_SEPARATOR}\n{value}\n{PROMPT_SEPARATOR}")
+    return "\n\n".join(parts) + "\n"
+
+
+def cache_key(model: str, params: dict, prompt: str) -> str:
+    """
+    Key of an LLM response: the model, its parameters and the prompt hash.
+    :param model: model name
+    :param params: model and retrieval parameters
+    :param prompt: prompt
+    :return: hex sha256 digest
+    """
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    material = json.dumps({"model": model, "params": params, "prompt": prompt_hash}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded on-disk cache of LLM responses, least recently used entries are evicted first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                response = file.read()
+        except FileNotFoundError:
+            return None
+
+        # a hit makes the entry the most recently used one
+        os.utime(path)
+        return response
+
+    def put(self, key: str, response: str):
+        path = self._path(key)
+        data = response.encode("utf-8")
+
+        with self.lock:
+            if os.path.exists(path):
+                self.size -= os.path.getsize(path)
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+            self.size += len(data)
+
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            self.size -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+class Cassette:
+    """
+    Recorded LLM responses for deterministic replays. Responses to the same key are
+    replayed in recording order, the last one repeats once they run out.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.responses = defaultdict(list)
+        self.replayed = defaultdict(int)
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    record = json.loads(line)
+                    self.responses[record["key"]].append(record["response"])
+
+    def record(self, key: str, prompt: str, response: str):
+        with self.lock:
+            self.responses[key].append(response)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"key": key, "prompt": prompt, "response": response}, ensure_ascii=False) + "\n")
+
+    def replay(self, key: str) -> str:
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                raise KeyError(f"No recorded LLM response for key {key}")
+
+            index = min(self.replayed[key], len(responses) - 1)
+            self.replayed[key] += 1
+            return responses[index]
+
+
+class LLMClient:
+    """
+    Access to the LLM for the workflow and hints: replay or cache first, then a live
+    (optionally hedged) request whose response is cached and recorded.
+    Modes: "live" calls the LLM, "record" also writes every live response to the cassette,
+    "replay" serves responses from the cassette only and never calls the LLM.
+    Live requests are retried with backoff behind a circuit breaker when one is given. Under a deadline
+    a request is made with a provider timeout of the time left, so it is not left running past it.
+    engine_factory(timeout) returns a query engine whose LLM requests time out after timeout seconds,
+    None for the default timeout.
+    """
+
+    def __init__(self, engine_factory, model: str, params: dict, mode: str = "live",
+                 cache: ResponseCache = None, cassette: Cassette = None, hedger=None,
+                 breaker=None, retries: int = 0, backoff=None):
+        self.engine_factory = engine_factory
+        self.model = model
+        self.params = params
+        self.mode = mode
+        self.cache = cache
+        self.cassette = cassette
+        self.hedger = hedger
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff = backoff
+        self._engine = None
+
+    @property
+    def engine(self):
+        # created lazily so replays work without the vector store and the LLM provider
+        if self._engine is None:
+            self._engine = self.engine_factory(timeout=None)
+        return self._engine
+
+    def _query(self, prompt: str):
+        left = remaining()
+        if left is None:
+            return self.engine.query(prompt)
+
+        check_deadline("calling the LLM")
+        return self.engine_factory(timeout=left).query(prompt)
+
+    def _stored(self, key: str, prompt: str, cache: bool) -> str | None:
+        if self.mode == "replay":
+            return self.cassette.replay(key)
+
+        response = None
+        if cache and self.cache is not None:
+            response = self.cache.get(key)
+
+        # a recording has to cover cache hits too, or replaying it would miss them
+        if response is not None and self.mode == "record":
+            self.cassette.record(key, prompt, response)
+        return response
+
+    def _store(self, key: str, prompt: str, response: str, cache: bool):
+        if cache and self.cache is not None:
+            self.cache.put(key, response)
+        if self.mode == "record":
+            self.cassette.record(key, prompt, response)
+
+    def _call(self, fn):
+        if self.breaker is None:
+            check_deadline("calling the LLM")
+            try:
+                return fn()
+            except Exception as e:
+                # a provider timeout shortened to the deadline
+                left = remaining()
+                if is_transient_llm_error(e) and left is not None and left <= 0:
+                    raise DeadlineExceeded("Deadline exceeded calling the LLM") from e
+                raise
+        return call_with_retry(fn, breaker=self.breaker, is_transient=is_transient_llm_error, retries=self.retries,
+                               backoff=self.backoff)
+
+    def _live_stream(self, prompt: str):
+        def first_chunk():
+            response_gen = self._query(prompt).response_gen
+            return response_gen, list(itertools.islice(response_gen, 1))
+
+        def hedged_first_chunk():
+            # the hedger waits no longer than the deadline itself
+            response_gen = self.hedger.stream(lambda: self._query(prompt).response_gen)
+            return response_gen, list(itertools.islice(response_gen, 1))
+
+        # a stream is retried until its first chunk, later chunks cannot be taken back
+        response_gen, first = self._call(first_chunk if self.hedger is None else hedged_first_chunk)
+        return itertools.chain(first, response_gen)
+
+    def stream(self, prompt: str, cache: bool = True):
+        """
+        Stream a response.
+        :param prompt: prompt
+        :param cache: serve from and store into the response cache
+        :return: generator of text chunks
+        """
+        key = cache_key(self.model, self.params, prompt)
+        stored = self._stored(key, prompt, cache)
+
+        if stored is not None:
+            yield from stored.splitlines(keepends=True)
+            return
+
+        chunks = []
+        for chunk in self._live_stream(prompt):
+            chunks.append(chunk)
+            yield chunk
+
+        # only a completely streamed response is stored
+        self._store(key, prompt, "".join(chunks), cache)
+
+    def text(self, prompt: str, validate=None, cache: bool = True) -> str:
+        """
+        Get a whole response.
+        :param prompt: prompt
+        :param validate: callable checking a response, only valid responses are stored
+        :param cache: serve from and store into the response cache
+        :return: response text
+        """
+        key = cache_key(self.model, self.params, prompt)
+        stored = self._stored(key, prompt, cache)
+
+        if stored is not None:
+            return stored
+
+        if self.hedger is None:
+            response = self._call(lambda: str(self._query(prompt)))
+        else:
+            response = self._call(lambda: self.hedger.text(lambda: self._query(prompt).response_gen,
+                                                           validate=validate))
+
+        if validate is None or validate(response):
+            self._store(key, prompt, response, cache)
+
+        return response
+
+
+@st.cache_resource
+def get_llm_client() -> LLMClient:
+    """
+    Function that returns the process-wide LLM client configured from secrets
+    (LLM_MODE, LLM_CASSETTE, LLM_CACHE_DIR, LLM_CACHE_MAX_MB, LLM_RETRIES).
+    :return: LLMClient
+    """
+    mode = st.secrets.get("LLM_MODE", "live")
+    if mode not in ("live", "record", "replay"):
+        raise ValueError(f"Unknown LLM_MODE: {mode}")
+
+    cache = None
+    if st.secrets.get("LLM_CACHE_DIR"):
+        cache = ResponseCache(st.secrets["LLM_CACHE_DIR"],
+                              max_bytes=int(float(st.secrets.get("LLM_CACHE_MAX_MB", 50)) * 1024 * 1024))
+
+    cassette = None
+    if mode != "live":
+        cassette = Cassette(st.secrets.get("LLM_CASSETTE", "llm_cassette.jsonl"))
+
+    return LLMClient(
+        engine_factory=get_vs_store,
+        model=LLM_MODEL,
+        params={"temperature": LLM_TEMPERATURE, "index": VS_TABLE_NAME},
+        mode=mode,
+        cache=cache,
+        cassette=cassette,
+        hedger=get_hedger(),
+        breaker=get_breakers().get("llm"),
+        retries=int(st.secrets.get("LLM_RETRIES", 2)),
+    )
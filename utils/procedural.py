@@ -0,0 +1,186 @@
+import itertools
+import random
+import re
+from datetime import datetime, timedelta
+
+from utils.scheduler import Priority
+from utils.tenancy import scope_query
+from utils.utils import scheduled_connection
+
+FAMILY_NAMES = [
+    "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+    "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "斎藤", "清水",
+    "山崎", "森", "池田", "橋本", "阿部", "石川", "山下", "中島", "石井", "小川",
+]
+
+GIVEN_NAMES = [
+    "翔太", "蓮", "大翔", "悠真", "陽斗", "湊", "健一", "誠", "浩", "隆",
+    "陽菜", "結衣", "さくら", "美咲", "葵", "凛", "恵子", "真理", "由美", "智子",
+    "拓海", "颯太", "悠人", "直樹", "和也", "優子", "明美", "千尋", "彩", "舞",
+]
+
+RELATIONSHIPS = ["隣人", "同僚", "旧友", "取引先", "常連客", "元同級生", "配達員", "遠い親戚", "家主", "顧客"]
+
+MOTIVES = ["なし", "金銭トラブル", "嫉妬", "仕事上の対立", "過去の因縁", "不明", "借金", "遺産", "口論", "恨み"]
+
+PLACES = ["駅前のカフェ", "図書館", "自宅", "会社", "スポーツジム", "居酒屋", "映画館", "公園", "病院", "コンビニ",
+          "書店", "美容院", "レストラン", "ホテルのロビー", "商店街", "河川敷", "神社", "バス停", "駐車場", "市場"]
+
+ALIBI_TEMPLATES = ["{place}にいた", "{place}で友人と会っていた", "{place}で買い物をしていた", "{place}で一人で過ごしていた",
+                   "{place}から電話をかけていた", "{place}に向かう途中だった"]
+
+EVIDENCE_TEMPLATES = ["{place}で見つかった古いレシート", "{place}に落ちていた手袋", "{place}の防犯カメラ映像",
+                      "{place}で拾われた名刺", "{place}付近の足跡", "{place}に残されたメモ", "{place}で見つかった鍵"]
+
+# indexes created after the bulk load, covering the filter columns players use, named like the index
+# advisor names them so neither creates a duplicate; join columns are foreign keys and already indexed
+SECONDARY_INDEXES = [
+    ("Alibis", "idx_alibis_alibi_time", ["alibi_time"]),
+    ("Evidence", "idx_evidence_found_at_location", ["found_at_location"]),
+    ("Suspects", "idx_suspects_name", ["name"]),
+]
+
+
+def name_key(name: str) -> str:
+    """
+    Function that normalizes a person name for comparison, "佐藤 翔太", "佐藤　翔太" and "佐藤翔太" are the same person.
+    :param name: name as written
+    :return: name without whitespace, case folded
+    """
+    return re.sub(r"\s+", "", name or "").casefold()
+
+
+class FillerGenerator:
+    """
+    Deterministic generator of plausible filler rows for a large case. Rows are produced lazily,
+    ids continue after the core rows written by the LLM and filler evidence only points to filler suspects.
+    """
+
+    def __init__(self, seed: int, suspects: int, first_suspect_id: int, first_alibi_id: int,
+                 first_evidence_id: int, scene_ids: list, time_of_death: datetime, reserved_names: set):
+        self.seed = seed
+        self.suspects = suspects
+        self.first_suspect_id = first_suspect_id
+        self.first_alibi_id = first_alibi_id
+        self.first_evidence_id = first_evidence_id
+        self.scene_ids = scene_ids or [None]
+        self.time_of_death = time_of_death
+        self.reserved_names = {name_key(name) for name in reserved_names}
+
+    def _random(self, table: str) -> random.Random:
+        # one stream per table, so every table is reproducible on its own
+        return random.Random(f"{self.seed}:{table}")
+
+    def suspect_rows(self):
+        rng = self._random("Suspects")
+        for suspect_id in range(self.first_suspect_id, self.first_suspect_id + self.suspects):
+            name = f"{rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)}"
+            while name_key(name) in self.reserved_names:
+                name = f"{rng.choice(FAMILY_NAMES)} {rng.choice(GIVEN_NAMES)}"
+            yield suspect_id, name, rng.randint(18, 85), rng.choice(RELATIONSHIPS), rng.choice(MOTIVES)
+
+    def alibi_rows(self):
+        rng = self._random("Alibis")
+        alibi_id = self.first_alibi_id
+        for suspect_id in range(self.first_suspect_id, self.first_suspect_id + self.suspects):
+            for _ in range(rng.randint(1, 3)):
+                alibi = rng.choice(ALIBI_TEMPLATES).format(place=rng.choice(PLACES))
+                alibi_time = self.time_of_death + timedelta(minutes=rng.randint(-360, 360))
+                yield alibi_id, suspect_id, alibi, rng.random() < 0.6, alibi_time
+                alibi_id += 1
+
+    def evidence_rows(self):
+        rng = self._random("Evidence")
+        last_suspect_id = self.first_suspect_id + self.suspects - 1
+        for evidence_id in range(self.first_evidence_id, self.first_evidence_id + self.suspects):
+            place = rng.choice(PLACES)
+            description = rng.choice(EVIDENCE_TEMPLATES).format(place=place)
+            suspect_id = rng.randint(self.first_suspect_id, last_suspect_id) if rng.random() < 0.7 else None
+            yield evidence_id, description, place, suspect_id, rng.choice(self.scene_ids)
+
+
+FILLER_COLUMNS = {
+    "Suspects": ["suspect_id", "name", "age", "relationship_to_victim", "motive"],
+    "Alibis": ["alibi_id", "suspect_id", "alibi", "alibi_verified", "alibi_time"],
+    "Evidence": ["evidence_id", "description", "found_at_location", "points_to_suspect_id", "scene_id"],
+}
+
+
+def chunked(rows, size: int):
+    """
+    Split an iterator of rows into lists of at most size rows.
+    :param rows: iterator of rows
+    :param size: chunk size
+    :return: generator of lists
+    """
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _scoped(query: str, game_id: str | None) -> str:
+    return query if game_id is None else scope_query(query, game_id)
+
+
+def _read_core(cursor, game_id: str | None) -> dict:
+    def scalar(query: str):
+        cursor.execute(_scoped(query, game_id))
+        return next(iter(cursor.fetchone().values()))
+
+    cursor.execute(_scoped("SELECT scene_id FROM CrimeScene;", game_id))
+    scene_ids = [row['scene_id'] for row in cursor.fetchall()]
+
+    cursor.execute(_scoped("SELECT name FROM Suspects;", game_id))
+    names = {row['name'] for row in cursor.fetchall()}
+
+    return {
+        "first_suspect_id": (scalar("SELECT MAX(suspect_id) FROM Suspects;") or 0) + 1,
+        "first_alibi_id": (scalar("SELECT MAX(alibi_id) FROM Alibis;") or 0) + 1,
+        "first_evidence_id": (scalar("SELECT MAX(evidence_id) FROM Evidence;") or 0) + 1,
+        "time_of_death": scalar("SELECT MIN(time_of_death) FROM Victim;") or datetime(2024, 1, 1, 22, 0),
+        "scene_ids": scene_ids,
+        "reserved_names": names,
+    }
+
+
+def add_filler_data(schema_name: str, seed: int, suspects: int, game_id: str = None,
+                    session_id: str = None, chunk_size: int = 2000) -> dict:
+    """
+    Turn a generated game into a large case: stream procedurally generated filler suspects, alibis
+    and evidence into the game tables in chunks, then create the secondary indexes.
+    :param schema_name: schema holding the game
+    :param seed: seed of the procedural generator
+    :param suspects: number of filler suspects, alibis and evidence scale with it
+    :param game_id: game in the shared tables, None for a per-player schema
+    :param session_id: session charged for the load
+    :param chunk_size: rows per multi-row insert and commit
+    :return: number of rows loaded per table
+    """
+    counts = {}
+
+    with scheduled_connection(Priority.GENERATION, session_id, database=schema_name, autocommit=False) as conn:
+        with conn.cursor() as cursor:
+            generator = FillerGenerator(seed=seed, suspects=suspects, **_read_core(cursor, game_id))
+
+            for table, rows in (("Suspects", generator.suspect_rows()),
+                                ("Alibis", generator.alibi_rows()),
+                                ("Evidence", generator.evidence_rows())):
+                columns = FILLER_COLUMNS[table]
+                if game_id is not None:
+                    columns = ["game_id"] + columns
+                    rows = ((game_id,) + row for row in rows)
+
+                query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                counts[table] = 0
+
+                for chunk in chunked(rows, chunk_size):
+                    cursor.executemany(query, chunk)
+                    conn.commit()
+                    counts[table] += len(chunk)
+
+            # the shared tables already carry (game_id, ...) indexes
+            if game_id is None:
+                for table, index_name, index_columns in SECONDARY_INDEXES:
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(index_columns)});")
+
+    return counts
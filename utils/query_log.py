@@ -0,0 +1,248 @@
+import atexit
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+import streamlit as st
+from sqlglot import exp, parse_one
+
+from utils.scheduler import Priority
+
+QUERY_LOG_DDL = """
+CREATE TABLE IF NOT EXISTS query_log (
+    id BIGINT AUTO_RANDOM PRIMARY KEY,
+    logged_at DATETIME(3),
+    kind VARCHAR(32),
+    schema_name VARCHAR(100),
+    fingerprint_id CHAR(16),
+    fingerprint TEXT,
+    query TEXT,
+    latency_ms DOUBLE,
+    row_count INT,
+    bytes BIGINT,
+    KEY idx_query_log_fingerprint (fingerprint_id)
+);
+"""
+
+
+def fingerprint(sql_query: str) -> tuple[str, str]:
+    """
+    Normalize a query so that queries differing only in literals share one fingerprint.
+    :param sql_query: query text
+    :return: fingerprint id and normalized query text
+    """
+    try:
+        tree = parse_one(sql_query, read="mysql")
+        for literal in list(tree.find_all(exp.Literal)):
+            literal.replace(exp.Placeholder())
+        normalized = tree.sql(dialect="mysql")
+    except Exception:
+        # fall back to a textual normalization for queries sqlglot cannot parse
+        normalized = re.sub(r"'(?:[^'\\]|\\.)*'|\b\d+(?:\.\d+)?\b", "?", sql_query)
+        normalized = re.sub(r"\s+", " ", normalized).strip().rstrip(";")
+
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16], normalized
+
+
+class FileSink:
+    """
+    Query log sink appending JSON lines to a local file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, entries: list):
+        with open(self.path, "a", encoding="utf-8") as file:
+            for entry in entries:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class TiDBSink:
+    """
+    Query log sink inserting batches into the query_log table.
+    """
+
+    def __init__(self, connect, schema_name: str):
+        self.connect = connect
+        self.schema_name = schema_name
+        self.created = False
+
+    def write(self, entries: list):
+        with self.connect(database=self.schema_name) as conn:
+            with conn.cursor() as cursor:
+                if not self.created:
+                    cursor.execute(QUERY_LOG_DDL)
+                    self.created = True
+
+                cursor.executemany(
+                    "INSERT INTO query_log (logged_at, kind, schema_name, fingerprint_id, fingerprint, query, "
+                    "latency_ms, row_count, bytes) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    [(entry["logged_at"], entry["kind"], entry["schema"], entry["fingerprint_id"],
+                      entry["fingerprint"], entry["query"], entry["latency_ms"], entry["rows"], entry["bytes"])
+                     for entry in entries])
+
+
+class QueryLog:
+    """
+    In-memory buffer of executed queries flushed in batches to a sink by a background thread,
+    with a slow log for queries over a latency threshold.
+    """
+
+    def __init__(self, sink, batch_size: int = 50, flush_interval: float = 10,
+                 slow_ms: float = 500, slow_log_path: str = None):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.slow_ms = slow_ms
+        self.slow_log_path = slow_log_path
+
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.wakeup = threading.Event()
+
+        threading.Thread(target=self._run, name="query-log", daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self, kind: str, schema_name: str, sql_query: str, latency_ms: float, rows: int, size: int):
+        """
+        Record one executed query.
+        :param kind: player, generation, cleanup...
+        :param schema_name: schema the query ran in
+        :param sql_query: query text
+        :param latency_ms: execution and fetch time in milliseconds
+        :param rows: rows returned or affected
+        :param size: bytes returned or sent
+        """
+        fingerprint_id, normalized = fingerprint(sql_query)
+        entry = {
+            "logged_at": datetime.now().isoformat(timespec="milliseconds"),
+            "kind": kind,
+            "schema": schema_name,
+            "fingerprint_id": fingerprint_id,
+            "fingerprint": normalized,
+            "query": sql_query,
+            "latency_ms": round(latency_ms, 3),
+            "rows": rows,
+            "bytes": size,
+        }
+
+        if latency_ms >= self.slow_ms:
+            self._slow(entry)
+
+        with self.lock:
+            self.buffer.append(entry)
+            full = len(self.buffer) >= self.batch_size
+
+        if full:
+            self.wakeup.set()
+
+    def _slow(self, entry: dict):
+        line = (f"# Time: {entry['logged_at']} Kind: {entry['kind']} Schema: {entry['schema']} "
+                f"Query_time_ms: {entry['latency_ms']} Rows: {entry['rows']} Bytes: {entry['bytes']}\n"
+                f"{entry['query'].strip()}\n")
+        if self.slow_log_path:
+            with open(self.slow_log_path, "a", encoding="utf-8") as file:
+                file.write(line)
+        else:
+            print(line, end="")
+
+    def flush(self):
+        """
+        Write the buffered entries to the sink.
+        """
+        with self.lock:
+            entries, self.buffer = self.buffer, []
+
+        if not entries:
+            return
+
+        try:
+            self.sink.write(entries)
+        except Exception as e:
+            print(f"Failed to flush {len(entries)} query log entries: {e}")
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+
+def read_query_log(path: str = None, tidb: bool = False, kind: str = None, since: datetime = None) -> list:
+    """
+    Function that reads query log entries back from the file or the query_log table.
+    :param path: query log file written by the file sink, defaults to QUERY_LOG_PATH
+    :param tidb: read the query_log table in QUERY_LOG_SCHEMA instead of the file
+    :param kind: only return one kind of query, e.g. player or generation
+    :param since: only return entries logged at or after this time
+    :return: list of entries
+    """
+    if tidb:
+        # imported here, utils.utils itself logs through this module
+        from utils.utils import get_connection
+
+        database = st.secrets.get("QUERY_LOG_SCHEMA", "original_game_schema")
+        with get_connection(database=database) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT logged_at, kind, schema_name AS `schema`, fingerprint_id, fingerprint, query, "
+                               "latency_ms, row_count AS `rows`, bytes FROM query_log;")
+                entries = cursor.fetchall()
+    else:
+        with open(path or st.secrets.get("QUERY_LOG_PATH", "query_log.jsonl"), "r", encoding="utf-8") as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+
+    if kind:
+        entries = [entry for entry in entries if entry["kind"] == kind]
+    if since:
+        entries = [entry for entry in entries if datetime.fromisoformat(str(entry["logged_at"])) >= since]
+    return entries
+
+
+class Timer:
+    """
+    Context manager measuring the wall time of a block in milliseconds.
+    """
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.ms = None
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        return False
+
+
+@st.cache_resource
+def get_query_log() -> QueryLog | None:
+    """
+    Function that returns the process-wide query log configured from secrets
+    (QUERY_LOG_SINK "file", "tidb" or "off", QUERY_LOG_PATH, SLOW_QUERY_MS, SLOW_QUERY_LOG_PATH).
+    :return: QueryLog or None when disabled
+    """
+    sink_name = st.secrets.get("QUERY_LOG_SINK", "file")
+
+    if sink_name == "off":
+        return None
+    if sink_name == "file":
+        sink = FileSink(st.secrets.get("QUERY_LOG_PATH", "query_log.jsonl"))
+    elif sink_name == "tidb":
+        # imported here, utils.utils itself logs through this module
+        from utils.utils import scheduled_connection
+
+        sink = TiDBSink(lambda database: scheduled_connection(Priority.LOGGING, database=database),
+                        schema_name=st.secrets.get("QUERY_LOG_SCHEMA", "original_game_schema"))
+    else:
+        raise ValueError(f"Unknown QUERY_LOG_SINK: {sink_name}")
+
+    return QueryLog(
+        sink=sink,
+        batch_size=int(st.secrets.get("QUERY_LOG_BATCH", 50)),
+        flush_interval=float(st.secrets.get("QUERY_LOG_FLUSH_SECONDS", 10)),
+        slow_ms=float(st.secrets.get("SLOW_QUERY_MS", 500)),
+        slow_log_path=st.secrets.get("SLOW_QUERY_LOG_PATH"),
+    )
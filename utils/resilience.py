@@ -0,0 +1,267 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+# absolute time.monotonic() by which the current unit of work has to be done, None for no deadline
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when the deadline of the current unit of work has passed.
+    """
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling a dependency while its circuit breaker is open.
+    """
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Give the block at most this many seconds, or less when an enclosing block has an earlier deadline.
+    The deadline follows the block into asyncio tasks it starts and into calls run with copy_context().
+    :param seconds: time budget of the block
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """
+    Function that returns the seconds left until the current deadline.
+    :return: seconds, None when there is no deadline
+    """
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline(what: str = "call"):
+    """
+    Function that fails when the current deadline has already passed.
+    :param what: description of the work about to start, for the error message
+    :raises DeadlineExceeded
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {what}")
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time up to base * multiplier ** n,
+    capped, so that sessions retrying after the same brownout spread out.
+    """
+
+    def __init__(self, base: float = 0.2, cap: float = 5.0, multiplier: float = 2.0, seed: int = None):
+        self.base = base
+        self.cap = cap
+        self.multiplier = multiplier
+        self.random = random.Random(seed)
+
+    def delay(self, attempt: int) -> float:
+        return self.random.uniform(0, min(self.cap, self.base * self.multiplier ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one dependency. After failure_threshold consecutive failures it opens and
+    rejects calls for reset_timeout seconds, then lets a single probe through (half open):
+    a successful probe closes it, a failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.metrics = {"calls": 0, "successes": 0, "failures": 0, "rejections": 0, "opened": 0}
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+            self.state = state
+            if state == self.OPEN:
+                self.opened_at = time.monotonic()
+                self.metrics["opened"] += 1
+
+    def _rejects(self) -> bool:
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self.state == self.HALF_OPEN and self.probing
+
+    def check(self):
+        """
+        Fail fast while the breaker rejects calls, without taking the half-open probe.
+        :raises CircuitOpenError
+        """
+        with self.lock:
+            if self._rejects():
+                self.metrics["rejections"] += 1
+                raise CircuitOpenError(f"{self.name} is unavailable, circuit breaker is {self.state}")
+
+    def allow(self):
+        """
+        Admit a call, taking the probe when the breaker is due to half open.
+        :raises CircuitOpenError
+        """
+        with self.lock:
+            if self._rejects():
+                self.metrics["rejections"] += 1
+                raise CircuitOpenError(f"{self.name} is unavailable, circuit breaker is {self.state}")
+            if self.state == self.OPEN:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                self.probing = True
+            self.metrics["calls"] += 1
+
+    def record_success(self):
+        with self.lock:
+            self.metrics["successes"] += 1
+            self.failures = 0
+            self.probing = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.metrics["failures"] += 1
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+
+    def release(self):
+        """
+        Give back the half-open probe of a call that ended without telling whether the dependency works,
+        e.g. because the caller's deadline passed.
+        """
+        with self.lock:
+            self.probing = False
+
+    def snapshot(self) -> dict:
+        """
+        Current state and counters.
+        :return: state, consecutive failures, calls, successes, failures, rejections and times opened
+        """
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.failures, **self.metrics}
+
+
+class BreakerRegistry:
+    """
+    Circuit breakers of the process, one per dependency.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self.lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            return self.breakers[name]
+
+    def snapshot(self) -> dict:
+        """
+        Breaker metrics of every dependency.
+        :return: mapping of dependency name to CircuitBreaker.snapshot()
+        """
+        with self.lock:
+            breakers = list(self.breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+@st.cache_resource
+def get_breakers() -> BreakerRegistry:
+    """
+    Function that returns the process-wide circuit breakers
+    (BREAKER_FAILURES consecutive failures open a breaker for BREAKER_RESET_SECONDS).
+    :return: BreakerRegistry
+    """
+    return BreakerRegistry(failure_threshold=int(st.secrets.get("BREAKER_FAILURES", 5)),
+                           reset_timeout=float(st.secrets.get("BREAKER_RESET_SECONDS", 30)))
+
+
+def get_backoff() -> Backoff:
+    """
+    Function that returns the retry backoff configured from secrets (RETRY_BASE_SECONDS, RETRY_MAX_SECONDS).
+    :return: Backoff
+    """
+    return Backoff(base=float(st.secrets.get("RETRY_BASE_SECONDS", 0.2)),
+                   cap=float(st.secrets.get("RETRY_MAX_SECONDS", 5)))
+
+
+def call_with_retry(fn, breaker: CircuitBreaker, is_transient, retries: int = 3, backoff: Backoff = None):
+    """
+    Call a dependency through its circuit breaker, retrying transient errors with jittered exponential
+    backoff as long as the current deadline leaves time for it. Other errors mean the dependency answered:
+    they are raised at once and count as a success of the dependency.
+    :param fn: callable doing the call
+    :param breaker: circuit breaker of the dependency
+    :param is_transient: callable telling whether an exception is a transient failure of the dependency
+    :param retries: retries after the first attempt
+    :param backoff: Backoff, defaults to get_backoff()
+    :return: result of fn
+    :raises CircuitOpenError, DeadlineExceeded or the last transient error
+    """
+    backoff = backoff or get_backoff()
+
+    for attempt in range(retries + 1):
+        check_deadline(f"calling {breaker.name}")
+        breaker.allow()
+
+        try:
+            result = fn()
+        except DeadlineExceeded:
+            # the caller ran out of time, that says nothing about the dependency
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                # the dependency answered, the error is the caller's
+                breaker.record_success()
+                raise
+
+            left = remaining()
+            if left is not None and left <= 0:
+                # a timeout shortened to the caller's deadline is not a failure of the dependency either
+                breaker.release()
+                raise DeadlineExceeded(f"Deadline exceeded calling {breaker.name}") from e
+
+            breaker.record_failure()
+
+            delay = backoff.delay(attempt)
+            if attempt == retries or (left is not None and left <= delay):
+                raise
+            print(f"{breaker.name} call failed: {e}. Retrying in {delay:.2f} seconds...")
+            time.sleep(delay)
+        except BaseException:
+            # interrupted, the dependency was not at fault
+            breaker.release()
+            raise
+        else:
+            breaker.record_success()
+            return result
@@ -0,0 +1,172 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+
+import streamlit as st
+
+from utils.resilience import DeadlineExceeded, remaining
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of database work, lower values are admitted first.
+    """
+    INTERACTIVE = 0  # player queries and solution checks
+    GENERATION = 1   # schema creation and generated game data
+    LEADERBOARD = 2  # leaderboard writes
+    CLEANUP = 3      # dropping and resetting finished games
+    LOGGING = 4      # query log writes
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the rate of database work of a single session.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token, going into debt when the bucket is empty.
+        :return: seconds to wait before the reserved token is actually available
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class QueryScheduler:
+    """
+    Admission control in front of the TiDB cluster shared by all sessions of the process.
+    Every session is rate limited by its own token bucket, then waits for one of a bounded
+    number of global slots, which are handed out by priority class and in arrival order within a class.
+    """
+
+    def __init__(self, max_concurrency: int, session_rate: float, session_burst: int, idle_timeout: float = 600):
+        self.max_concurrency = max_concurrency
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.idle_timeout = idle_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+        self._stats = {priority: {"admitted": 0, "total_wait": 0.0, "max_wait": 0.0} for priority in Priority}
+
+    def _bucket(self, session_id: str) -> TokenBucket:
+        with self._buckets_lock:
+            now = time.monotonic()
+
+            # forget buckets of sessions that went away
+            idle = [key for key, bucket in self._buckets.items() if now - bucket.updated > self.idle_timeout]
+            for key in idle:
+                del self._buckets[key]
+
+            if session_id not in self._buckets:
+                self._buckets[session_id] = TokenBucket(self.session_rate, self.session_burst)
+            return self._buckets[session_id]
+
+    @contextmanager
+    def slot(self, priority: Priority, session_id: str = None):
+        """
+        Hold a global slot for the duration of the block.
+        :param priority: priority class of the work
+        :param session_id: session to charge against its token bucket, None for no per-session limit
+        :return: seconds spent waiting for admission
+        :raises DeadlineExceeded: when the current deadline passes before admission
+        """
+        start = time.monotonic()
+
+        if session_id is not None:
+            delay = self._bucket(session_id).reserve()
+            if delay > 0:
+                left = remaining()
+                if left is not None and left < delay:
+                    raise DeadlineExceeded(f"{priority.name} query would be rate limited past its deadline")
+                time.sleep(delay)
+
+        with self._cond:
+            entry = (int(priority), next(self._seq))
+            heapq.heappush(self._waiting, entry)
+
+            while self._active >= self.max_concurrency or self._waiting[0] != entry:
+                left = remaining()
+                if left is not None and left <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise DeadlineExceeded(f"{priority.name} query was not admitted before its deadline")
+                self._cond.wait(left)
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+
+            waited = time.monotonic() - start
+            stats = self._stats[priority]
+            stats["admitted"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+
+            # the next waiter may fit into a free slot as well
+            self._cond.notify_all()
+
+        if waited > 0.1:
+            print(f"{priority.name} query waited {waited * 1000:.0f} ms for admission")
+
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Queue-wait statistics per priority class.
+        :return: mapping of priority name to admitted count, mean and max wait in ms
+        """
+        with self._cond:
+            report = {
+                "active": self._active,
+                "waiting": len(self._waiting),
+            }
+            for priority, stats in self._stats.items():
+                admitted = stats["admitted"]
+                report[priority.name] = {
+                    "admitted": admitted,
+                    "mean_wait_ms": stats["total_wait"] / admitted * 1000 if admitted else 0.0,
+                    "max_wait_ms": stats["max_wait"] * 1000,
+                }
+            return report
+
+
+@st.cache_resource
+def get_scheduler() -> QueryScheduler:
+    """
+    Function that returns the process-wide query scheduler.
+    :return: QueryScheduler
+    """
+    return QueryScheduler(
+        max_concurrency=int(st.secrets.get("DB_MAX_CONCURRENCY", 16)),
+        session_rate=float(st.secrets.get("SESSION_QUERY_RATE", 5)),
+        session_burst=int(st.secrets.get("SESSION_QUERY_BURST", 10)),
+    )
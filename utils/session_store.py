@@ -0,0 +1,270 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import pymysql
+import streamlit as st
+
+from utils.resilience import CircuitOpenError, DeadlineExceeded
+from utils.scheduler import Priority
+from utils.utils import scheduled_connection
+
+# game state that survives a reconnect or a move to another app replica
+PERSISTED_KEYS = ["current_user", "ai_story", "user_queries", "ai_hints", "user_solutions", "start_time",
+                  "end_time", "elapsed_time", "game_schema", "game_id", "played_games"]
+
+# a store that is down must not take the game down with it
+STORE_ERRORS = (sqlite3.Error, pymysql.Error, CircuitOpenError, DeadlineExceeded)
+
+SESSION_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS session_state (
+    session_key VARCHAR(255) PRIMARY KEY,
+    state BLOB,
+    updated_at DOUBLE
+);
+"""
+
+
+def encode_state(state: dict) -> bytes:
+    """
+    Function that serializes session state to compact JSON compressed with zlib.
+    :param state: JSON-compatible state
+    :return: bytes
+    """
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_state(data: bytes) -> dict:
+    """
+    Function that deserializes session state written by encode_state.
+    :param data: bytes
+    :return: state
+    """
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class SQLiteSessionStore:
+    """
+    Session state backend in a local SQLite file, shared by the app processes of one node.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.conn.execute(SESSION_STATE_DDL.replace("VARCHAR(255)", "TEXT").replace("DOUBLE", "REAL"))
+
+    def read(self, session_key: str) -> bytes | None:
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM session_state WHERE session_key = ? AND updated_at >= ?;",
+                                    (session_key, time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def write(self, session_key: str, data: bytes):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO session_state (session_key, state, updated_at) "
+                              "VALUES (?, ?, ?);", (session_key, data, time.time()))
+
+    def delete(self, session_key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM session_state WHERE session_key = ?;", (session_key,))
+
+
+class TiDBSessionStore:
+    """
+    Session state backend in the session_state table, shared by app replicas on any node.
+    """
+
+    def __init__(self, connect, schema_name: str, ttl: float):
+        self.connect = connect
+        self.schema_name = schema_name
+        self.ttl = ttl
+
+        with self.connect(database=self.schema_name) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SESSION_STATE_DDL)
+
+    def read(self, session_key: str) -> bytes | None:
+        with self.connect(database=self.schema_name) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT state FROM session_state WHERE session_key = %s AND updated_at >= %s;",
+                               (session_key, time.time() - self.ttl))
+                row = cursor.fetchone()
+        return row['state'] if row else None
+
+    def write(self, session_key: str, data: bytes):
+        with self.connect(database=self.schema_name) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("REPLACE INTO session_state (session_key, state, updated_at) VALUES (%s, %s, %s);",
+                               (session_key, data, time.time()))
+
+    def delete(self, session_key: str):
+        with self.connect(database=self.schema_name) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM session_state WHERE session_key = %s;", (session_key,))
+
+
+class SessionStore:
+    """
+    Write-through session state store in front of a backend. The last state written by each session
+    is kept in memory, so unchanged state is not written again. Reads always go to the backend: they only
+    happen when a session (re)connects, possibly after another replica wrote its state.
+    The memory is bounded: the least recently written of max_sessions sessions are forgotten, and so is
+    state written more than half the TTL ago, so that the backend copy of an idle game is refreshed before it expires.
+    """
+
+    def __init__(self, backend, ttl: float = 24 * 3600, max_sessions: int = 10000):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        # session key -> (last written state, time.monotonic() of the write), oldest write first
+        self.written = OrderedDict()
+
+    def _remember(self, session_key: str, data: bytes):
+        with self.lock:
+            self.written[session_key] = (data, time.monotonic())
+            self.written.move_to_end(session_key)
+            while len(self.written) > self.max_sessions:
+                self.written.popitem(last=False)
+
+    def _unchanged(self, session_key: str, data: bytes) -> bool:
+        with self.lock:
+            # forget writes old enough for the backend copy to need refreshing
+            cutoff = time.monotonic() - self.ttl / 2
+            while self.written and next(iter(self.written.values()))[1] < cutoff:
+                self.written.popitem(last=False)
+
+            entry = self.written.get(session_key)
+            return entry is not None and entry[0] == data
+
+    def load(self, session_key: str) -> dict | None:
+        """
+        Read the state of a session.
+        :param session_key: session to read
+        :return: state or None when the session is unknown or expired
+        """
+        data = self.backend.read(session_key)
+        if data is None:
+            return None
+
+        self._remember(session_key, data)
+        return decode_state(data)
+
+    def save(self, session_key: str, state: dict):
+        """
+        Write the state of a session through to the backend when it changed.
+        :param session_key: session to write
+        :param state: JSON-compatible state
+        """
+        data = encode_state(state)
+        if self._unchanged(session_key, data):
+            return
+
+        self.backend.write(session_key, data)
+        self._remember(session_key, data)
+
+    def delete(self, session_key: str):
+        """
+        Forget the state of a session.
+        :param session_key: session to forget
+        """
+        self.backend.delete(session_key)
+        with self.lock:
+            self.written.pop(session_key, None)
+
+
+@st.cache_resource
+def get_session_store() -> SessionStore | None:
+    """
+    Function that returns the process-wide session store configured from secrets
+    (SESSION_STORE "sqlite", "tidb" or "off", SESSION_STORE_PATH, SESSION_STATE_SCHEMA, SESSION_TTL_HOURS,
+    SESSION_STORE_MAX_SESSIONS).
+    :return: SessionStore or None when disabled
+    """
+    backend_name = st.secrets.get("SESSION_STORE", "sqlite")
+    ttl = float(st.secrets.get("SESSION_TTL_HOURS", 24)) * 3600
+
+    if backend_name == "off":
+        return None
+    if backend_name == "sqlite":
+        backend = SQLiteSessionStore(st.secrets.get("SESSION_STORE_PATH", "session_state.db"), ttl=ttl)
+    elif backend_name == "tidb":
+        backend = TiDBSessionStore(lambda database: scheduled_connection(Priority.INTERACTIVE, database=database),
+                                   schema_name=st.secrets.get("SESSION_STATE_SCHEMA", "original_game_schema"),
+                                   ttl=ttl)
+    else:
+        raise ValueError(f"Unknown SESSION_STORE: {backend_name}")
+
+    return SessionStore(backend, ttl=ttl, max_sessions=int(st.secrets.get("SESSION_STORE_MAX_SESSIONS", 10000)))
+
+
+def is_persisted(session_key: str | None) -> bool:
+    """
+    Check if the state of a session is kept in the session store. Sessions without the X-Streamlit-User
+    header all share the USER_TOKEN fallback, their state would be handed to every new visitor.
+    :param session_key: session key
+    :return: boolean
+    """
+    return session_key is not None and session_key != st.secrets.get("USER_TOKEN")
+
+
+def restore_session_state(session_key: str) -> bool:
+    """
+    Function that rehydrates st.session_state from the session store, for a player reconnecting
+    to this or another app replica. An unavailable store leaves the fresh state in place.
+    :param session_key: session to restore
+    :return: True when a stored state was restored
+    """
+    if not is_persisted(session_key):
+        return False
+
+    try:
+        store = get_session_store()
+        state = store.load(session_key) if store is not None else None
+    except STORE_ERRORS as e:
+        print(f"Failed to restore the session state of {session_key}: {e}")
+        return False
+    if state is None:
+        return False
+
+    for key in PERSISTED_KEYS:
+        if key in state:
+            st.session_state[key] = state[key]
+    return True
+
+
+def save_session_state():
+    """
+    Function that writes the persisted keys of st.session_state through to the session store.
+    """
+    if not is_persisted(st.session_state.get("current_user")):
+        return
+
+    try:
+        store = get_session_store()
+        if store is not None:
+            store.save(st.session_state.current_user,
+                       {key: st.session_state.get(key) for key in PERSISTED_KEYS})
+    except STORE_ERRORS as e:
+        print(f"Failed to save the session state of {st.session_state.current_user}: {e}")
+
+
+def clear_session_state():
+    """
+    Function that removes the stored state of the current session, once its game is over.
+    """
+    if not is_persisted(st.session_state.get("current_user")):
+        return
+
+    try:
+        store = get_session_store()
+        if store is not None:
+            store.delete(st.session_state.current_user)
+    except STORE_ERRORS as e:
+        print(f"Failed to clear the session state of {st.session_state.current_user}: {e}")
@@ -0,0 +1,238 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+
+import streamlit as st
+from pymysql.cursors import Cursor
+
+from utils.tenancy import scope_query
+from utils.scheduler import Priority
+from utils.utils import GAME_TABLES, scheduled_connection
+
+SNAPSHOT_FORMAT = "queryhunt-snapshot"
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_dir() -> str:
+    """
+    Function that returns the directory where game snapshots are stored.
+    :return: directory path
+    """
+    return st.secrets.get("SNAPSHOT_DIR", "snapshots")
+
+
+def _value_type(value) -> str | None:
+    """
+    Map a python value fetched from TiDB to a snapshot column type.
+    :param value: column value
+    :return: type name or None for NULL
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, datetime.datetime):
+        return "datetime"
+    if isinstance(value, datetime.date):
+        return "date"
+    return "str"
+
+
+def _encode(value, value_type: str):
+    if value is None:
+        return None
+    if value_type in ("datetime", "date"):
+        return value.isoformat()
+    if value_type == "str":
+        return str(value)
+    return value
+
+
+def _decode(value, value_type: str):
+    if value is None:
+        return None
+    if value_type == "datetime":
+        return datetime.datetime.fromisoformat(value)
+    if value_type == "date":
+        return datetime.date.fromisoformat(value)
+    return value
+
+
+def build_snapshot(story: str, tables: dict) -> dict:
+    """
+    Build a snapshot from the story and the raw rows of every game table.
+    :param story: game story shown to the player
+    :param tables: mapping of table name to (column names, list of row tuples)
+    :return: snapshot dict
+    """
+    snapshot_tables = []
+    answer = None
+
+    for table in GAME_TABLES:
+        columns, rows = tables.get(table, ([], []))
+
+        # the type of a column is taken from its first non-NULL value
+        types = []
+        for i in range(len(columns)):
+            types.append(next((_value_type(row[i]) for row in rows if row[i] is not None), "str"))
+
+        encoded_rows = [[_encode(value, types[i]) for i, value in enumerate(row)] for row in rows]
+        snapshot_tables.append({"name": table, "columns": list(columns), "types": types, "rows": encoded_rows})
+
+        if table == "Murderer" and rows and "name" in columns:
+            answer = rows[0][list(columns).index("name")]
+
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "story": story,
+        "answer": answer,
+        "tables": snapshot_tables,
+    }
+    snapshot["id"] = snapshot_id(snapshot)
+
+    return snapshot
+
+
+def snapshot_id(snapshot: dict) -> str:
+    """
+    Content hash of a snapshot, independent of when and where it was written.
+    :param snapshot: snapshot dict
+    :return: hex sha256 digest
+    """
+    content = {key: snapshot[key] for key in ("version", "story", "answer", "tables")}
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def dump_snapshot(snapshot: dict) -> bytes:
+    """
+    Serialize a snapshot to compact gzipped JSON.
+    :param snapshot: snapshot dict
+    :return: compressed bytes
+    """
+    payload = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # mtime=0 keeps the output byte-identical for the same game
+    return gzip.compress(payload, mtime=0)
+
+
+def load_snapshot(data: bytes) -> dict:
+    """
+    Deserialize a snapshot and check its format and version.
+    :param data: compressed bytes
+    :return: snapshot dict
+    """
+    snapshot = json.loads(gzip.decompress(data).decode("utf-8"))
+
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError("Not a QueryHunt game snapshot")
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+
+    return snapshot
+
+
+def write_snapshot(snapshot: dict, directory: str = None) -> str:
+    """
+    Write a snapshot to the snapshot directory, named by its content hash.
+    :param snapshot: snapshot dict
+    :param directory: target directory, defaults to SNAPSHOT_DIR
+    :return: path of the written file
+    """
+    directory = directory or get_snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, f"{snapshot['id']}.json.gz")
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "wb") as file:
+        file.write(dump_snapshot(snapshot))
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Read a snapshot file.
+    :param path: path of the snapshot file
+    :return: snapshot dict
+    """
+    with open(path, "rb") as file:
+        return load_snapshot(file.read())
+
+
+def capture_snapshot(schema_name: str, story: str, game_id: str = None, session_id: str = None) -> dict:
+    """
+    Read back every game table of a schema and build a snapshot from it.
+    :param schema_name: schema holding the game
+    :param story: game story shown to the player
+    :param game_id: game to read from shared tables, None for a per-player schema
+    :param session_id: session charged for the reads
+    :return: snapshot dict
+    """
+    tables = {}
+
+    with scheduled_connection(Priority.GENERATION, session_id, database=schema_name) as conn:
+        with conn.cursor(Cursor) as cursor:
+            for table in GAME_TABLES:
+                query = f"SELECT * FROM {table};"
+                if game_id is not None:
+                    query = scope_query(query, game_id)
+
+                cursor.execute(query)
+                rows = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+                tables[table] = (columns, rows)
+
+    return build_snapshot(story=story, tables=tables)
+
+
+def restore_snapshot(schema_name: str, snapshot: dict, reset: bool = True, game_id: str = None,
+                     session_id: str = None):
+    """
+    Bulk-load a snapshot into an existing game schema in a single transaction.
+    :param schema_name: schema with the game tables already created
+    :param snapshot: snapshot dict
+    :param reset: delete existing game rows first
+    :param game_id: game to load into shared tables, None for a per-player schema
+    :param session_id: session charged for the load
+    """
+    with scheduled_connection(Priority.GENERATION, session_id, database=schema_name, autocommit=False) as conn:
+        try:
+            with conn.cursor() as cursor:
+                if reset:
+                    for table in reversed(GAME_TABLES):
+                        query = f"DELETE FROM {table};"
+                        if game_id is not None:
+                            query = scope_query(query, game_id)
+                        cursor.execute(query)
+
+                for table in snapshot["tables"]:
+                    if not table["rows"]:
+                        continue
+
+                    column_names = table["columns"]
+                    rows = [tuple(_decode(value, table["types"][i]) for i, value in enumerate(row))
+                            for row in table["rows"]]
+
+                    if game_id is not None:
+                        column_names = ["game_id"] + column_names
+                        rows = [(game_id,) + row for row in rows]
+
+                    columns = ", ".join(column_names)
+                    placeholders = ", ".join(["%s"] * len(column_names))
+
+                    # pymysql batches executemany of an INSERT ... VALUES into multi-row inserts
+                    cursor.executemany(f"INSERT INTO {table['name']} ({columns}) VALUES ({placeholders})", rows)
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,236 @@
+from functools import cache
+
+import streamlit as st
+from sqlglot import exp, parse_one
+
+from utils.scheduler import Priority
+from utils.utils import GAME_TABLE_DDL, GAME_TABLES, scheduled_connection
+
+# shared tables hold every game, keyed by game_id in front of the original primary key
+SHARED_TABLE_DDL = {
+    "Victim": """
+    CREATE TABLE IF NOT EXISTS Victim (
+        game_id VARCHAR(64) NOT NULL,
+        victim_id INT NOT NULL,
+        name VARCHAR(100),
+        age INT,
+        occupation VARCHAR(100),
+        time_of_death DATETIME,
+        location_of_death VARCHAR(100),
+        PRIMARY KEY (game_id, victim_id)
+    );
+    """,
+    "Suspects": """
+    CREATE TABLE IF NOT EXISTS Suspects (
+        game_id VARCHAR(64) NOT NULL,
+        suspect_id INT NOT NULL,
+        name VARCHAR(100),
+        age INT,
+        relationship_to_victim VARCHAR(100),
+        motive VARCHAR(100),
+        PRIMARY KEY (game_id, suspect_id)
+    );
+    """,
+    "Alibis": """
+    CREATE TABLE IF NOT EXISTS Alibis (
+        game_id VARCHAR(64) NOT NULL,
+        alibi_id INT NOT NULL,
+        suspect_id INT,
+        alibi VARCHAR(255),
+        alibi_verified BOOLEAN,
+        alibi_time DATETIME,
+        PRIMARY KEY (game_id, alibi_id),
+        KEY idx_alibis_suspect (game_id, suspect_id),
+        FOREIGN KEY (game_id, suspect_id) REFERENCES Suspects(game_id, suspect_id)
+    );
+    """,
+    "CrimeScene": """
+    CREATE TABLE IF NOT EXISTS CrimeScene (
+        game_id VARCHAR(64) NOT NULL,
+        scene_id INT NOT NULL,
+        location VARCHAR(100),
+        description TEXT,
+        evidence_found BOOLEAN,
+        victim_id INT,
+        PRIMARY KEY (game_id, scene_id),
+        KEY idx_crimescene_victim (game_id, victim_id),
+        FOREIGN KEY (game_id, victim_id) REFERENCES Victim(game_id, victim_id)
+    );
+    """,
+    "Evidence": """
+    CREATE TABLE IF NOT EXISTS Evidence (
+        game_id VARCHAR(64) NOT NULL,
+        evidence_id INT NOT NULL,
+        description TEXT,
+        found_at_location VARCHAR(100),
+        points_to_suspect_id INT,
+        scene_id INT,
+        PRIMARY KEY (game_id, evidence_id),
+        KEY idx_evidence_suspect (game_id, points_to_suspect_id),
+        KEY idx_evidence_scene (game_id, scene_id),
+        FOREIGN KEY (game_id, points_to_suspect_id) REFERENCES Suspects(game_id, suspect_id),
+        FOREIGN KEY (game_id, scene_id) REFERENCES CrimeScene(game_id, scene_id)
+    );
+    """,
+    "Murderer": """
+    CREATE TABLE IF NOT EXISTS Murderer (
+        game_id VARCHAR(64) NOT NULL,
+        murderer_id INT NOT NULL,
+        suspect_id INT,
+        name VARCHAR(100),
+        PRIMARY KEY (game_id, murderer_id),
+        KEY idx_murderer_suspect (game_id, suspect_id),
+        FOREIGN KEY (game_id, suspect_id) REFERENCES Suspects(game_id, suspect_id)
+    );
+    """,
+}
+
+
+def is_shared_mode() -> bool:
+    """
+    Check if games are stored in one shared set of tables partitioned by game_id
+    instead of a schema per player.
+    :return: boolean
+    """
+    return st.secrets.get("STORAGE_MODE", "schema") == "shared"
+
+
+def get_shared_schema() -> str:
+    """
+    Function that returns the schema holding the shared game tables.
+    :return: schema name
+    """
+    return st.secrets.get("SHARED_SCHEMA", "queryhunt_shared")
+
+
+def game_location(user_token: str) -> tuple[str, str | None]:
+    """
+    Function that returns where a freshly generated game of a player is stored.
+    :param user_token: unique player token
+    :return: schema name and game id, the game id is None in per-schema mode
+    """
+    if is_shared_mode():
+        return get_shared_schema(), user_token
+
+    return user_token, None
+
+
+@st.cache_resource
+def ensure_shared_tables() -> str:
+    """
+    Create the shared schema and tables once per process.
+    :return: shared schema name
+    """
+    schema_name = get_shared_schema()
+
+    with scheduled_connection(Priority.GENERATION) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
+
+    with scheduled_connection(Priority.GENERATION, database=schema_name) as conn:
+        with conn.cursor() as cursor:
+            for query in SHARED_TABLE_DDL.values():
+                cursor.execute(query)
+
+    return schema_name
+
+
+@cache
+def get_table_columns() -> dict[str, list[str]]:
+    """
+    Function that returns the player-visible columns of every game table, read from the game DDL.
+    :return: mapping of table name to column names
+    """
+    columns = {}
+    for table, ddl in GAME_TABLE_DDL.items():
+        create = parse_one(ddl, read="mysql")
+        columns[table] = [column.name for column in create.this.expressions
+                          if isinstance(column, exp.ColumnDef)]
+    return columns
+
+
+def _game_table(name: str) -> str | None:
+    # TiDB compares table names case-insensitively, so do the same
+    return next((table for table in GAME_TABLES if table.lower() == name.lower()), None)
+
+
+def _game_filter(game_id: str) -> exp.Expression:
+    return exp.EQ(this=exp.column("game_id"), expression=exp.Literal.string(game_id))
+
+
+def _scope_select(tree: exp.Expression, game_id: str) -> exp.Expression:
+    columns = get_table_columns()
+
+    # a CTE named like a game table can read the unscoped table under that name, so none may shadow one
+    for cte in tree.find_all(exp.CTE):
+        if _game_table(cte.alias):
+            raise ValueError(f"A common table expression cannot be named like the game table {cte.alias}")
+
+    for table in list(tree.find_all(exp.Table)):
+        name = _game_table(table.name)
+        if name is None:
+            continue
+
+        # every game table becomes a filtered derived table under the name the player used
+        scoped = (exp.select(*columns[name])
+                  .from_(exp.to_table(name))
+                  .where(_game_filter(game_id))
+                  .subquery(table.alias_or_name))
+        table.replace(scoped)
+
+    return tree
+
+
+def _scope_insert(tree: exp.Insert, game_id: str) -> exp.Insert:
+    target = tree.this
+    table = target.this if isinstance(target, exp.Schema) else target
+    name = _game_table(table.name)
+
+    if name is None:
+        raise ValueError(f"Insert into unknown table: {table.name}")
+    if not isinstance(tree.expression, exp.Values):
+        raise ValueError("Only INSERT ... VALUES is supported in shared storage mode")
+
+    if isinstance(target, exp.Schema):
+        columns = list(target.expressions)
+    else:
+        columns = [exp.to_identifier(column) for column in get_table_columns()[name]]
+
+    tree.set("this", exp.Schema(this=exp.to_table(name), expressions=[exp.to_identifier("game_id")] + columns))
+
+    for row in tree.expression.expressions:
+        row.set("expressions", [exp.Literal.string(game_id)] + list(row.expressions))
+
+    return tree
+
+
+def scope_query(sql_query: str, game_id: str) -> str:
+    """
+    Rewrite a query against the game tables so it only sees or touches the rows of one game.
+    SELECTs read every game table through a derived table filtered by game_id, INSERTs get the
+    game_id column added and DELETEs get a game_id predicate.
+    :param sql_query: query written against the plain game tables
+    :param game_id: game the query is scoped to
+    :return: rewritten query
+    :raises ValueError: for a query that cannot be confined to one game
+    """
+    tree = parse_one(sql_query, read="mysql")
+
+    if isinstance(tree, exp.Insert):
+        tree = _scope_insert(tree, game_id)
+    elif isinstance(tree, exp.Delete):
+        tree = tree.where(_game_filter(game_id), append=True)
+    else:
+        tree = _scope_select(tree, game_id)
+
+    return tree.sql(dialect="mysql")
+
+
+def scope_queries(query_list: list, game_id: str) -> list:
+    """
+    Function to scope a list of queries to one game.
+    :param query_list: queries written against the plain game tables
+    :param game_id: game the queries are scoped to
+    :return: list of rewritten queries
+    """
+    return [scope_query(query, game_id) for query in query_list]
@@ -1,7 +1,9 @@
 import random
 import re
-import time
+import socket
+from contextlib import contextmanager
 
+import pyarrow as pa
 import pymysql
 import sqlparse
 import streamlit as st
@@ -11,10 +13,40 @@ from llama_index.core.vector_stores.types import (MetadataFilter,
 from llama_index.llms.openai import OpenAI
 from llama_index.vector_stores.tidbvector import TiDBVectorStore
 from pymysql import Connection
+from pymysql.constants import FIELD_TYPE
 from pymysql.cursors import DictCursor
-from sqlalchemy.exc import OperationalError
 from sqlglot import errors, parse_one
 
+from utils.query_log import Timer, get_query_log
+from utils.resilience import (DeadlineExceeded, call_with_retry, get_breakers,
+                              remaining)
+from utils.scheduler import Priority, get_scheduler
+
+# model behind the query engine, also part of the LLM response cache key
+LLM_MODEL = "gpt-4o-mini"
+LLM_TEMPERATURE = 1
+VS_TABLE_NAME = "vs_game_schema"
+
+# client errors of a connection that could not be made or was lost: can't connect, server has gone away,
+# lost connection during query. Errors the server answered with (unknown database, access denied...) are not.
+TRANSIENT_DB_ERRNOS = (2003, 2006, 2013)
+
+
+def is_transient_db_error(e: Exception) -> bool:
+    """
+    Function that tells whether a database error is a connection-level failure worth retrying.
+    :param e: exception raised by pymysql, or by SQLAlchemy wrapping pymysql
+    :return: bool
+    """
+    e = getattr(e, "orig", None) or e
+    if isinstance(e, DeadlineExceeded):
+        return False
+    if isinstance(e, (socket.timeout, TimeoutError)):
+        return True
+    if isinstance(e, pymysql.err.OperationalError):
+        return bool(e.args) and e.args[0] in TRANSIENT_DB_ERRNOS
+    return False
+
 
 def get_connection_string(database: str = "test", autocommit: bool = True) -> str:
     """
@@ -24,7 +56,7 @@ def get_connection_string(database: str = "test", autocommit: bool = True) -> st
     """
     db_conf = {
         "host": st.secrets['TIDB_HOST'],
-        "port": 4000,
+        "port": int(st.secrets.get('TIDB_PORT', 4000)),
         "user": st.secrets['TIDB_USER'],
         "password": st.secrets['TIDB_PASSWORD'],
         "autocommit": autocommit,
@@ -33,22 +65,25 @@ def get_connection_string(database: str = "test", autocommit: bool = True) -> st
     if database:
         db_conf["database"] = database
 
-    db_conf["ssl_verify_cert"] = True
-    db_conf["ssl_verify_identity"] = True
-    db_conf["ssl_ca"] = st.secrets["TIDB_CA"]
+    connection_string = f"mysql+pymysql://{db_conf['user']}:{db_conf['password']}@{db_conf['host']}:{db_conf['port']}/{database}"
+
+    # a local TiDB/MySQL (e.g. tiup playground) has no TLS, leave TIDB_CA empty for it
+    if st.secrets.get("TIDB_CA"):
+        db_conf["ssl_ca"] = st.secrets["TIDB_CA"]
+        connection_string += f"?ssl_ca={db_conf['ssl_ca']}&ssl_verify_cert=true&ssl_verify_identity=true"
 
-    connection_string = f"mysql+pymysql://{db_conf['user']}:{db_conf['password']}@{db_conf['host']}:{db_conf['port']}/{database}?ssl_ca={db_conf['ssl_ca']}&ssl_verify_cert=true&ssl_verify_identity=true"
     return connection_string
 
 def get_connection(database: str = None, autocommit: bool = True) -> Connection:
     """
-    Function that returns connection object to TiDB Serverless cluster.
+    Function that returns connection object to TiDB Serverless cluster, retrying transient connection
+    errors with backoff behind the "tidb" circuit breaker. Socket timeouts follow the current deadline.
     :param: autocommit
     :return: pymysql connection
     """
     db_conf = {
         "host": st.secrets['TIDB_HOST'],
-        "port": 4000,
+        "port": int(st.secrets.get('TIDB_PORT', 4000)),
         "user": st.secrets['TIDB_USER'],
         "password": st.secrets['TIDB_PASSWORD'],
         "autocommit": autocommit,
@@ -58,24 +93,146 @@ def get_connection(database: str = None, autocommit: bool = True) -> Connection:
     if database:
         db_conf["database"] = database
 
-    db_conf["ssl_verify_cert"] = True
-    db_conf["ssl_verify_identity"] = True
-    db_conf["ssl_ca"] = st.secrets["TIDB_CA"]
+    # a local TiDB/MySQL (e.g. tiup playground) has no TLS, leave TIDB_CA empty for it
+    if st.secrets.get("TIDB_CA"):
+        db_conf["ssl_verify_cert"] = True
+        db_conf["ssl_verify_identity"] = True
+        db_conf["ssl_ca"] = st.secrets["TIDB_CA"]
 
-    return pymysql.connect(**db_conf)
+    left = remaining()
+    if left is not None:
+        db_conf["connect_timeout"] = max(0.1, min(10, left))
+        db_conf["read_timeout"] = db_conf["write_timeout"] = max(0.1, left)
 
+    return call_with_retry(lambda: pymysql.connect(**db_conf), breaker=get_breakers().get("tidb"),
+                           is_transient=is_transient_db_error, retries=int(st.secrets.get("DB_RETRIES", 3)))
 
-def run_queries_in_schema(schema_name: str, query_list: list):
+
+@contextmanager
+def scheduled_connection(priority: Priority, session_id: str = None, database: str = None,
+                         autocommit: bool = True) -> Connection:
+    """
+    Function that returns connection object to TiDB Serverless cluster once the query scheduler admits the work.
+    :param priority: priority class of the work
+    :param session_id: session charged for the work
+    :param database: database to connect to
+    :param autocommit
+    :return: pymysql connection
+    """
+    # fail fast instead of queueing for a slot while TiDB is known to be down
+    get_breakers().get("tidb").check()
+
+    with get_scheduler().slot(priority, session_id):
+        with get_connection(database=database, autocommit=autocommit) as conn:
+            yield conn
+
+
+def run_queries_in_schema(schema_name: str, query_list: list, priority: Priority = Priority.GENERATION,
+                          session_id: str = None):
     """
     Function to execute queries within a specific schema in TiDB cluster.
     :param schema_name: Name of the schema to use
     :param query_list: List of SQL queries to execute
+    :param priority: priority class of the queries
+    :param session_id: session charged for the queries, defaults to the schema name
     """
-    with get_connection(database=schema_name) as conn:
+    query_log = get_query_log()
+
+    with scheduled_connection(priority, session_id or schema_name, database=schema_name) as conn:
         with conn.cursor() as cursor:
             cursor.execute("SET SESSION tidb_multi_statement_mode='ON';")
             for query in query_list:
-                cursor.execute(query)
+                with Timer() as timer:
+                    cursor.execute(query)
+
+                if query_log is not None:
+                    query_log.record(priority.name.lower(), schema_name, query, timer.ms,
+                                     rows=cursor.rowcount, size=len(query.encode("utf-8")))
+
+
+# Arrow types of MySQL column types, DECIMAL gets the precision and scale of its column,
+# other types are inferred from the values
+ARROW_TYPES = {
+    FIELD_TYPE.TINY: pa.int64(),
+    FIELD_TYPE.SHORT: pa.int64(),
+    FIELD_TYPE.INT24: pa.int64(),
+    FIELD_TYPE.LONG: pa.int64(),
+    FIELD_TYPE.LONGLONG: pa.int64(),
+    FIELD_TYPE.YEAR: pa.int64(),
+    FIELD_TYPE.FLOAT: pa.float64(),
+    FIELD_TYPE.DOUBLE: pa.float64(),
+    FIELD_TYPE.DATE: pa.date32(),
+    FIELD_TYPE.DATETIME: pa.timestamp("us"),
+    FIELD_TYPE.TIMESTAMP: pa.timestamp("us"),
+    FIELD_TYPE.TIME: pa.duration("us"),
+    FIELD_TYPE.VARCHAR: pa.string(),
+    FIELD_TYPE.VAR_STRING: pa.string(),
+    FIELD_TYPE.STRING: pa.string(),
+    FIELD_TYPE.JSON: pa.string(),
+}
+
+
+def _arrow_type(description: tuple):
+    type_code, length, scale = description[1], description[4], description[5] or 0
+    if type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL):
+        # the column length also counts the sign and the decimal point, so it bounds the precision
+        precision = max(min(length or 65, 76), scale, 1)
+        return pa.decimal128(precision, scale) if precision <= 38 else pa.decimal256(precision, scale)
+    return ARROW_TYPES.get(type_code)
+
+
+def _arrow_array(values: tuple, arrow_type) -> pa.Array:
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+        # e.g. binary strings or out of range values, let Arrow pick the type
+        return pa.array(values)
+
+
+def _unique_names(names: list) -> list:
+    # suffix repeated column names (e.g. suspect_id of both sides of a join) like pandas does: name, name.1, ...
+    unique = []
+    for name in names:
+        candidate, n = name, 0
+        while candidate in unique:
+            n += 1
+            candidate = f"{name}.{n}"
+        unique.append(candidate)
+    return unique
+
+
+def _chunked_column(chunks: list) -> pa.ChunkedArray:
+    # all-NULL chunks take the type of the others, chunks of different types fall back to strings
+    types = {chunk.type for chunk in chunks} - {pa.null()}
+    target = types.pop() if len(types) == 1 else (pa.string() if types else pa.null())
+    return pa.chunked_array([chunk if chunk.type == target else chunk.cast(target) for chunk in chunks], type=target)
+
+
+def fetch_arrow_table(cursor, chunk_size: int = 1000) -> pa.Table:
+    """
+    Fetch the result of an executed query as an Arrow table, chunk by chunk from a tuple cursor,
+    without building a python dict per row. Repeated column names get a numeric suffix.
+    :param cursor: tuple cursor (e.g. SSCursor) with an executed query
+    :param chunk_size: rows fetched and converted at once
+    :return: pyarrow Table
+    """
+    names = _unique_names([desc[0] for desc in cursor.description])
+    types = [_arrow_type(desc) for desc in cursor.description]
+    chunks = [[] for _ in names]
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+
+        for column_chunks, values, arrow_type in zip(chunks, zip(*rows), types):
+            column_chunks.append(_arrow_array(values, arrow_type))
+
+    if not chunks or not chunks[0]:
+        return pa.Table.from_arrays([pa.array([], type=arrow_type or pa.null()) for arrow_type in types], names=names)
+
+    # one schema for the whole result, every column a chunked array of its batches
+    return pa.Table.from_arrays([_chunked_column(column_chunks) for column_chunks in chunks], names=names)
 
 
 def is_valid_query(query: str) -> bool:
@@ -147,42 +304,49 @@ def clean_string(input_string: str) -> str:
 
 
 @st.cache_resource
-def get_vs_store(retries=3, delay=5):
+def get_vs_index(retries=3):
     """
-    Get the vector store index from TiDB Vector Store with retry logic.
-    :param retries: Number of retry attempts in case of failure.
-    :param delay: Delay between retries in seconds.
+    Get the vector store index from TiDB Vector Store, retrying connection errors with backoff
+    behind the "tidb" circuit breaker.
+    :param retries: Number of retries in case of failure.
     :return: VectorStoreIndex
     """
-    vs_table_name = "vs_game_schema"
-    
-    for attempt in range(retries):
-        try:
-            tidbvec = TiDBVectorStore(
-                connection_string=get_connection_string(st.secrets['TIDB_DATABASE']),
-                table_name=vs_table_name,
-                distance_strategy="cosine",
-                vector_dimension=1536,
-                drop_existing_table=False,
-            )
-            vs_store = VectorStoreIndex.from_vector_store(vector_store=tidbvec)
-
-            # Create the query engine using the loaded index
-            llm = OpenAI("gpt-4o-mini", temperature=1)
-            
-            query_engine = vs_store.as_query_engine(llm=llm, streaming=True, filters=MetadataFilters(
-                filters=[MetadataFilter(key="schema", value="sql_mystery_game",
-                                        operator="==")]))
-            
-            return query_engine
-        
-        except OperationalError as e:
-            if attempt < retries - 1:
-                st.warning(f"Connection error: {e}. Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                st.error(f"Failed to connect to the database after {retries} attempts.")
-                raise  # Re-raise the exception if all retries fail
+    vs_table_name = VS_TABLE_NAME
+
+    def connect():
+        tidbvec = TiDBVectorStore(
+            connection_string=get_connection_string(st.secrets['TIDB_DATABASE']),
+            table_name=vs_table_name,
+            distance_strategy="cosine",
+            vector_dimension=1536,
+            drop_existing_table=False,
+        )
+        return VectorStoreIndex.from_vector_store(vector_store=tidbvec)
+
+    return call_with_retry(connect, breaker=get_breakers().get("tidb"), is_transient=is_transient_db_error,
+                           retries=retries)
+
+
+def get_vs_store(retries=3, timeout: float = None):
+    """
+    Get a query engine over the vector store index. Engines are cheap to create, one is made per
+    LLM request that has to finish before a deadline.
+    :param retries: Number of retries in case of failure.
+    :param timeout: seconds an LLM request may take, defaults to LLM_REQUEST_TIMEOUT
+    :return: query engine
+    """
+    vs_store = get_vs_index(retries)
+
+    # retries of LLM requests are left to the LLM client, which also knows the deadline
+    llm = OpenAI(LLM_MODEL, temperature=LLM_TEMPERATURE, max_retries=0,
+                 timeout=timeout or float(st.secrets.get("LLM_REQUEST_TIMEOUT", 60)))
+
+    # Create the query engine using the loaded index
+    query_engine = vs_store.as_query_engine(llm=llm, streaming=True, filters=MetadataFilters(
+        filters=[MetadataFilter(key="schema", value="sql_mystery_game",
+                                operator="==")]))
+
+    return query_engine
 
 
 # def get_query_engine(vs_store):
@@ -196,100 +360,113 @@ def get_vs_store(retries=3, delay=5):
 #     return query_engine
 
 
-def create_schema_and_tables(schema_name: str):
+CREATE_TABLE_VICTIM = """
+CREATE TABLE Victim (
+    victim_id INT NOT NULL,
+    name VARCHAR(100),
+    age INT,
+    occupation VARCHAR(100),
+    time_of_death DATETIME,
+    location_of_death VARCHAR(100),
+    PRIMARY KEY (victim_id)
+);
+"""
+
+CREATE_TABLE_SUSPECTS = """
+CREATE TABLE Suspects (
+    suspect_id INT NOT NULL,
+    name VARCHAR(100),
+    age INT,
+    relationship_to_victim VARCHAR(100),
+    motive VARCHAR(100),
+    PRIMARY KEY (suspect_id)
+);
+"""
+
+CREATE_TABLE_ALIBIS = """
+CREATE TABLE Alibis (
+    alibi_id INT NOT NULL,
+    suspect_id INT,
+    alibi VARCHAR(255),
+    alibi_verified BOOLEAN,
+    alibi_time DATETIME,
+    PRIMARY KEY (alibi_id),
+    FOREIGN KEY (suspect_id) REFERENCES Suspects(suspect_id)
+);
+"""
+
+CREATE_TABLE_CRIMESCENE = """
+CREATE TABLE CrimeScene (
+    scene_id INT NOT NULL,
+    location VARCHAR(100),
+    description TEXT,
+    evidence_found BOOLEAN,
+    victim_id INT,
+    PRIMARY KEY (scene_id),
+    FOREIGN KEY (victim_id) REFERENCES Victim(victim_id)
+);
+"""
+
+CREATE_TABLE_EVIDENCE = """
+CREATE TABLE Evidence (
+    evidence_id INT NOT NULL,
+    description TEXT,
+    found_at_location VARCHAR(100),
+    points_to_suspect_id INT,
+    scene_id INT,
+    PRIMARY KEY (evidence_id),
+    FOREIGN KEY (points_to_suspect_id) REFERENCES Suspects(suspect_id),
+    FOREIGN KEY (scene_id) REFERENCES CrimeScene(scene_id)
+);
+"""
+
+CREATE_TABLE_MURDERER = """
+CREATE TABLE Murderer (
+    murderer_id INT NOT NULL,
+    suspect_id INT,
+    name VARCHAR(100),
+    PRIMARY KEY (murderer_id),
+    FOREIGN KEY (suspect_id) REFERENCES Suspects(suspect_id)
+);
+"""
+
+# DDL of the game tables in foreign key order, parents first
+GAME_TABLE_DDL = {
+    "Victim": CREATE_TABLE_VICTIM,
+    "Suspects": CREATE_TABLE_SUSPECTS,
+    "Alibis": CREATE_TABLE_ALIBIS,
+    "CrimeScene": CREATE_TABLE_CRIMESCENE,
+    "Evidence": CREATE_TABLE_EVIDENCE,
+    "Murderer": CREATE_TABLE_MURDERER,
+}
+
+GAME_TABLES = list(GAME_TABLE_DDL)
+
+
+def create_schema_and_tables(schema_name: str, session_id: str = None):
     """
     Function to create a schema and tables in TiDB cluster.
     :param schema_name: Name of the schema to create
+    :param session_id: session charged for the DDL, defaults to the schema name
     """
-    create_table_victim = f"""
-    CREATE TABLE Victim (
-        victim_id INT NOT NULL,
-        name VARCHAR(100),
-        age INT,
-        occupation VARCHAR(100),
-        time_of_death DATETIME,
-        location_of_death VARCHAR(100),
-        PRIMARY KEY (victim_id)
-    );
-    """
-
-    create_table_suspects = f"""
-    CREATE TABLE Suspects (
-        suspect_id INT NOT NULL,
-        name VARCHAR(100),
-        age INT,
-        relationship_to_victim VARCHAR(100),
-        motive VARCHAR(100),
-        PRIMARY KEY (suspect_id)
-    );
-    """
-
-    create_table_alibis = f"""
-    CREATE TABLE Alibis (
-        alibi_id INT NOT NULL,
-        suspect_id INT,
-        alibi VARCHAR(255),
-        alibi_verified BOOLEAN,
-        alibi_time DATETIME,
-        PRIMARY KEY (alibi_id),
-        FOREIGN KEY (suspect_id) REFERENCES Suspects(suspect_id)
-    );
-    """
-
-    create_table_crime_scene = f"""
-    CREATE TABLE CrimeScene (
-        scene_id INT NOT NULL,
-        location VARCHAR(100),
-        description TEXT,
-        evidence_found BOOLEAN,
-        victim_id INT,
-        PRIMARY KEY (scene_id),
-        FOREIGN KEY (victim_id) REFERENCES Victim(victim_id)
-    );
-    """
-
-    create_table_evidence = f"""
-    CREATE TABLE Evidence (
-        evidence_id INT NOT NULL,
-        description TEXT,
-        found_at_location VARCHAR(100),
-        points_to_suspect_id INT,
-        scene_id INT,
-        PRIMARY KEY (evidence_id),
-        FOREIGN KEY (points_to_suspect_id) REFERENCES Suspects(suspect_id),
-        FOREIGN KEY (scene_id) REFERENCES CrimeScene(scene_id)
-    );
-    """
-
-    create_table_murderer = f"""
-    CREATE TABLE Murderer (
-        murderer_id INT NOT NULL,
-        suspect_id INT,
-        name VARCHAR(100),
-        PRIMARY KEY (murderer_id),
-        FOREIGN KEY (suspect_id) REFERENCES Suspects(suspect_id)
-    );
-    """
-
-    table_queries = [
-        create_table_victim,
-        create_table_suspects,
-        create_table_alibis,
-        create_table_crime_scene,
-        create_table_evidence,
-        create_table_murderer
-    ]
+    session_id = session_id or schema_name
 
     # Step 1: Connect without specifying a database to create the schema
-    with get_connection() as conn:
+    with scheduled_connection(Priority.GENERATION, session_id) as conn:
         with conn.cursor() as cursor:
             cursor.execute(f"CREATE SCHEMA {schema_name};")
 
     # Step 2: Reconnect with the newly created schema
-    with get_connection(database=schema_name) as conn:
+    with scheduled_connection(Priority.GENERATION, session_id, database=schema_name) as conn:
         with conn.cursor() as cursor:
             cursor.execute("SET SESSION tidb_multi_statement_mode='ON';")
-            for query in table_queries:
+            for query in GAME_TABLE_DDL.values():
+                cursor.execute(query)
+
+            # secondary indexes accepted from the index advisor, imported here as the advisor reads this module
+            from utils.index_advisor import template_index_queries
+
+            for query in template_index_queries():
                 cursor.execute(query)
 
 
@@ -1,17 +1,24 @@
 import asyncio
+import contextvars
 import json
 import os
 import re
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
 from llama_index.core.workflow import (Context, Event, StartEvent, StopEvent,
                                        Workflow, step)
 from llama_index.llms.openai import OpenAI
 from pydantic import BaseModel, ValidationError, conlist
-from sqlglot import errors, parse_one
-
-from utils.utils import (clean_string, create_schema_and_tables, get_vs_store,
+from sqlglot import errors, exp, parse_one
+
+from utils.dry_run import dry_run_queries
+from utils.llm_client import build_prompt, get_llm_client
+from utils.resilience import deadline
+from utils.snapshot import capture_snapshot, write_snapshot
+from utils.tenancy import game_location, get_table_columns, scope_queries
+from utils.utils import (clean_string, create_schema_and_tables,
                          is_non_destructive, is_valid_sql,
                          run_queries_in_schema)
 
@@ -48,28 +55,22 @@ Return queries as JSON object with the following schema:
 {schema}
 ---------------------
 Do not return anything else
-Here's the story to reference: 
----------------------
-{story}
+Reference the story below.
 """
 
 QUERY_REFLECTION_PROMPT = """
-You already created this output previously:
----------------------
-{wrong_answer}
----------------------
-This caused the error: {error}
+Your previous output below caused the error below.
 Fix the error and return the corrected output using your knowledge about this dbml schema.
 Do not include line breaks or any other special characters.
 Do not add text: '```json'
 The response must contain only valid Python dictionary with the following schema:
 ---------------------
-{{
+{
   "queries": [
-    {{"query": "INSERT INTO Table;"}},
-    {{"query": "INSERT INTO Table;"}}
+    {"query": "INSERT INTO Table;"},
+    {"query": "INSERT INTO Table;"}
   ]
-}}
+}
 ---------------------
 """
 
@@ -114,8 +115,105 @@ class ValidatedSqlEvent(Event):
     queries: dict
 
 
-# initialize vector store and create query index
-query_engine = get_vs_store()
+# LLM access through the vector store query engine, with caching, record/replay and hedging
+llm = get_llm_client()
+
+
+def is_query_json(output: str) -> bool:
+    """
+    Check if an LLM response parses as the JSON collection of queries.
+    :param output: LLM response
+    :return: boolean
+    """
+    try:
+        query_dict = json.loads(clean_string(output))
+    except ValueError:
+        return False
+
+    return isinstance(query_dict, dict) and isinstance(query_dict.get('queries'), list)
+
+
+# heading of the story section that follows Plot and Characters
+OBJECTIVE_HEADING = re.compile(r'^[\s#*]*(?:\d+[.)]\s*)?(?:Objective|目的)', re.IGNORECASE | re.MULTILINE)
+CHARACTERS_HEADING = re.compile(r'^[\s#*]*(?:\d+[.)]\s*)?(?:Characters|登場人物|キャラクター)', re.IGNORECASE | re.MULTILINE)
+
+# generates game data from the story prefix while the rest of the story streams
+prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+
+
+def story_prefix(story: str) -> str | None:
+    """
+    Find the Plot and Characters part of a (partial) story.
+    :param story: story text streamed so far
+    :return: text up to the Objective heading, None while Characters are not complete yet
+    """
+    characters = CHARACTERS_HEADING.search(story)
+    if characters is None:
+        return None
+
+    objective = OBJECTIVE_HEADING.search(story, characters.end())
+    if objective is None:
+        return None
+
+    return story[:objective.start()]
+
+
+def tap_story(chunks, on_prefix):
+    """
+    Pass story chunks through, calling on_prefix once as soon as Plot and Characters are complete.
+    :param chunks: iterator of story chunks
+    :param on_prefix: callable receiving the story prefix
+    :return: generator of story chunks
+    """
+    story = ''
+    fired = False
+
+    for chunk in chunks:
+        story += chunk
+        if not fired:
+            prefix = story_prefix(story)
+            if prefix is not None:
+                fired = True
+                on_prefix(prefix)
+        yield chunk
+
+
+def missing_names(output: str, story: str) -> list[str]:
+    """
+    Consistency check of game data generated from a story prefix against the full story:
+    every victim, suspect and murderer name in the inserts has to appear in the story.
+    :param output: LLM response with the insert queries
+    :param story: full story
+    :return: names not found in the story
+    """
+    plain_story = re.sub(r'\s+', '', story)
+    table_columns = get_table_columns()
+    missing = []
+
+    for query in json.loads(clean_string(output))['queries']:
+        insert = parse_one(query['query'], read="mysql")
+        if not isinstance(insert, exp.Insert) or not isinstance(insert.expression, exp.Values):
+            continue
+
+        target = insert.this
+        table = target.this if isinstance(target, exp.Schema) else target
+        if table.name not in ('Victim', 'Suspects', 'Murderer'):
+            continue
+
+        if isinstance(target, exp.Schema):
+            columns = [column.name for column in target.expressions]
+        else:
+            columns = table_columns[table.name]
+        if 'name' not in columns:
+            continue
+
+        name_index = columns.index('name')
+        for row in insert.expression.expressions:
+            value = row.expressions[name_index]
+            if isinstance(value, exp.Literal) and re.sub(r'\s+', '', value.this) not in plain_story:
+                missing.append(value.this)
+
+    return missing
 
 
 # Define the workflow
@@ -126,14 +224,28 @@ class MysteryFlow(Workflow):
     
     max_retries: int = 3
 
+    # start generating game data from Plot and Characters while the story still streams
+    pipelined: bool = st.secrets.get("PIPELINED_GENERATION", False)
+
     @step(pass_context=True)
     async def generate_story(self, ctx: Context, ev: StartEvent) -> StoryEvent:
 
-        response = query_engine.query(STORY_PROMPT)
         story_chunks = []
+        # every game needs a new story, so it never comes from the response cache
+        stream = llm.stream(STORY_PROMPT, cache=False)
+
+        if self.pipelined:
+            def prefetch_tables(prefix: str):
+                print('Story prefix complete, generating game data')
+                prompt = build_prompt(QUERY_PROMPT.format(schema=QueryCollection.schema_json()), story=prefix)
+                # copy the context so the prefetch keeps the deadline of the workflow
+                ctx.data['tables_prefetch'] = prefetch_executor.submit(contextvars.copy_context().run,
+                                                                       llm.text, prompt, is_query_json)
+
+            stream = tap_story(stream, prefetch_tables)
 
         # stream the response to the frontend
-        for chunk in st.write_stream(response.response_gen):
+        for chunk in st.write_stream(stream):
             story_chunks.append(chunk)
 
         # Join all the collected chunks to form the complete story
@@ -145,15 +257,28 @@ class MysteryFlow(Workflow):
         return StoryEvent(story=str(full_story))
 
 
-    @step()
-    async def generate_tables(self, ev: StoryEvent) -> CreateTablesEvent:
- 
-        prompt = QUERY_PROMPT.format(schema=QueryCollection.schema_json(), story=ev.story)
-
-        response = query_engine.query(prompt)
+    @step(pass_context=True)
+    async def generate_tables(self, ctx: Context, ev: StoryEvent) -> CreateTablesEvent:
+
+        # game data generated from the story prefix is used if it agrees with the full story
+        prefetch = ctx.data.pop('tables_prefetch', None)
+        if prefetch is not None:
+            try:
+                response = await asyncio.wrap_future(prefetch)
+                missing = missing_names(response, ev.story)
+                if not missing:
+                    print(response)
+                    return CreateTablesEvent(output=response)
+                print('Prefetched game data does not match the story, missing names:', missing)
+            except Exception:
+                print('Prefetched game data is unusable', traceback.format_exc())
+
+        prompt = build_prompt(QUERY_PROMPT.format(schema=QueryCollection.schema_json()), story=ev.story)
+
+        response = llm.text(prompt, validate=is_query_json)
         #response = await self.llm.acomplete(prompt)
         print(response)
-        return CreateTablesEvent(output=str(response))
+        return CreateTablesEvent(output=response)
 
 
     @step(pass_context=True)
@@ -181,6 +306,9 @@ class MysteryFlow(Workflow):
                     raise Exception("Destructive SQL query detected")
                 continue
 
+            # apply the payload to a local copy of the tables, only a passing payload goes to TiDB
+            dry_run_queries([query['query'] for query in query_dict['queries']])
+
         except Exception:
             full_traceback = traceback.format_exc()
             print('the error is', full_traceback)
@@ -195,10 +323,15 @@ class MysteryFlow(Workflow):
     async def execute_queries(self, ctx: Context, ev: ValidatedSqlEvent) -> StopEvent | ValidationErrorEvent:
         query_dict = ev.queries
         query_list = [query['query'] for query in query_dict['queries']]
+        schema_name, game_id = game_location(self.user_token)
 
         print('trying to execute queries')
         try:
-            run_queries_in_schema(schema_name=self.user_token, query_list=query_list)
+            # in shared storage mode the inserts are rewritten to carry the game id
+            if game_id is not None:
+                query_list = scope_queries(query_list, game_id)
+
+            run_queries_in_schema(schema_name=schema_name, query_list=query_list, session_id=self.user_token)
 
         except Exception as e:
             full_traceback = traceback.format_exc()
@@ -208,7 +341,20 @@ class MysteryFlow(Workflow):
 
         print('Queries executed successfully')
 
-        return StopEvent(result={'story': ctx.data.get('story'), 'queries': query_dict})
+        # keep a snapshot of the validated game so it can be restored without the LLM
+        snapshot_path = None
+        snapshot_id = None
+        try:
+            snapshot = capture_snapshot(schema_name=schema_name, story=ctx.data.get('story'), game_id=game_id,
+                                        session_id=self.user_token)
+            snapshot_path = write_snapshot(snapshot)
+            snapshot_id = snapshot['id']
+            print('Snapshot written to', snapshot_path)
+        except Exception:
+            print('Failed to write snapshot', traceback.format_exc())
+
+        return StopEvent(result={'story': ctx.data.get('story'), 'queries': query_dict,
+                                 'snapshot': snapshot_path, 'snapshot_id': snapshot_id})
 
 
     @step(pass_context=True)
@@ -217,30 +363,29 @@ class MysteryFlow(Workflow):
         current_retries = ctx.data.get("retries", 0)
 
         if current_retries >= self.max_retries:
-            run_queries_in_schema(schema_name=self.user_token,
-                                  query_list=delete_queries)  # Reset tables if max retries are reached
+            schema_name, game_id = game_location(self.user_token)
+            reset_queries = delete_queries if game_id is None else scope_queries(delete_queries, game_id)
+            run_queries_in_schema(schema_name=schema_name, session_id=self.user_token,
+                                  query_list=reset_queries)  # Reset tables if max retries are reached
             return StopEvent(result="Max retries reached")
 
         else:
             ctx.data["retries"] = current_retries + 1
 
-            reflection_prompt = QUERY_REFLECTION_PROMPT.format(wrong_answer=str(ev.wrong_output), error=str(ev.error))
-            response = query_engine.query(reflection_prompt)
-
-            # Convert or extract the response to a suitable type
-            if isinstance(response, str):
-                output = response
-            elif hasattr(response, 'to_dict'):
-                output = response.to_dict()  # Assuming response has a `to_dict()` method
-            else:
-                output = str(response)  # Fallback to string conversion
+            reflection_prompt = build_prompt(QUERY_REFLECTION_PROMPT,
+                                             previous_output=str(ev.wrong_output), error=str(ev.error))
+            output = llm.text(reflection_prompt, validate=is_query_json)
 
         return CorrectedOutputEvent(output=output)
 
 
-async def run_workflow():
-    w = MysteryFlow(timeout=60, verbose=True)
-    result = await w.run()
+async def run_workflow(timeout: float = None):
+    # every DB and LLM call of the workflow gets what is left of one deadline,
+    # the workflow timeout only stops a step that ignores it
+    timeout = timeout or float(st.secrets.get("WORKFLOW_DEADLINE_SECONDS", 120))
+    with deadline(timeout):
+        w = MysteryFlow(timeout=timeout + 5, verbose=True)
+        result = await w.run()
     return result
 
 # if __name__ == "__main__":